@@ -0,0 +1,135 @@
+"""
+Lazy registry of the Filtering_Algorithm ground truth sets (PO2016, SANCRIS, POU).
+
+A set is opened by name. The first time, only its I and V variables are read from the .mat file and stored as .npy
+files together with the SOC derived from the delivered energy; from then on every array is memory-mapped, so opening
+a set costs no parsing and slices of it are views.
+"""
+from scipy.io import loadmat
+import json
+import os
+import numpy as np
+
+CACHE_VERSION = 1
+GROUND_TRUTH_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Filtering_Algorithm', 'Ground_truth')
+
+
+def cumulative_energy(V, I, dt=1.0):
+    # Cumulative trapezoidal integral of V * I, starting at zero
+    P = np.multiply(V, I)
+    return np.concatenate([[0.0], np.cumsum(0.5 * (P[1:] + P[:-1]) * dt)])
+
+
+class GroundTruthRegistry:
+    def __init__(self, folder=GROUND_TRUTH_FOLDER, cache_folder=None, dt=1.0):
+        """
+        Ground truth sets found in a folder, opened on demand.
+        :param folder:  folder with the <name>.mat files.
+        :param cache_folder:    where the <name>.cache directories are written. By default, the same folder.
+        :param dt:  sample time of the sets in seconds.
+        """
+        self.folder = folder
+        self.cacheFolder = folder if cache_folder is None else cache_folder
+        self.dt = dt
+        self.opened = dict()
+
+    def names(self):
+        return sorted(os.path.splitext(f)[0] for f in os.listdir(self.folder) if f.endswith('.mat'))
+
+    def open(self, name):
+        # The dataset object is kept, so opening the same name twice is free
+        if name not in self.opened:
+            mat_path = os.path.join(self.folder, name + '.mat')
+            cache_path = os.path.join(self.cacheFolder, name + '.cache')
+            if not is_cache_valid(cache_path, mat_path):
+                convert(mat_path, cache_path, dt=self.dt)
+            self.opened[name] = GroundTruthDataset(name, cache_path)
+        return self.opened[name]
+
+    def __getitem__(self, name):
+        return self.open(name)
+
+
+def convert(mat_path, cache_path, dt=1.0):
+    """
+    Writes the I, V and SOC arrays of a ground truth .mat file as .npy files.
+    :param mat_path:    path to the .mat file.
+    :param cache_path:  cache directory.
+    :param dt:  sample time in seconds.
+    :return:    the cache directory.
+    """
+    os.makedirs(cache_path, exist_ok=True)
+    x = loadmat(mat_path, variable_names=('I', 'V'))
+    I = np.ravel(x['I']).astype(float)
+    V = np.ravel(x['V']).astype(float)
+    E = cumulative_energy(V, I, dt)
+
+    np.save(os.path.join(cache_path, 'I.npy'), I)
+    np.save(os.path.join(cache_path, 'V.npy'), V)
+    np.save(os.path.join(cache_path, 'SOC.npy'), 1 - E / E[-1])
+
+    info = {'version': CACHE_VERSION,
+            'source': os.path.abspath(mat_path),
+            'source_mtime': os.path.getmtime(mat_path),
+            'dt': dt,
+            'Ecrit': E[-1]}
+    with open(os.path.join(cache_path, 'info.json'), 'w') as file_handle:
+        json.dump(info, file_handle, indent=2)
+    return cache_path
+
+
+def is_cache_valid(cache_path, mat_path):
+    try:
+        with open(os.path.join(cache_path, 'info.json'), 'r') as file_handle:
+            info = json.load(file_handle)
+    except (OSError, ValueError):
+        return False
+    return info.get('version') == CACHE_VERSION and info.get('source_mtime') == os.path.getmtime(mat_path)
+
+
+class GroundTruthDataset:
+    def __init__(self, name, cache_path):
+        """
+        Memory-mapped ground truth set. I, V and SOC are read-only 1-D arrays mapped on first access; Ecrit is the
+        energy of the whole discharge in J.
+        """
+        self.name = name
+        self.cachePath = cache_path
+        with open(os.path.join(cache_path, 'info.json'), 'r') as file_handle:
+            self.info = json.load(file_handle)
+        self.dt = self.info['dt']
+        self.Ecrit = self.info['Ecrit']
+        self.arrays = dict()
+
+    def array(self, name):
+        if name not in self.arrays:
+            self.arrays[name] = np.load(os.path.join(self.cachePath, name + '.npy'), mmap_mode='r')
+        return self.arrays[name]
+
+    @property
+    def I(self):
+        return self.array('I')
+
+    @property
+    def V(self):
+        return self.array('V')
+
+    @property
+    def SOC(self):
+        return self.array('SOC')
+
+    def __len__(self):
+        return np.size(self.V)
+
+    def slice(self, start=None, stop=None, step=None):
+        # Views of I, V and SOC over a range of samples
+        s = slice(start, stop, step)
+        return {'I': self.I[s], 'V': self.V[s], 'SOC': self.SOC[s]}
+
+
+# Default registry over the data folder of the repository
+registry = GroundTruthRegistry()
+
+
+def open_dataset(name):
+    return registry.open(name)
@@ -0,0 +1,241 @@
+"""
+Columnar cache of the NASA randomized battery usage (RW) datasets.
+
+Each RW*.mat file holds a struct array of steps with per-step voltage, current, temperature and time vectors. Parsing
+it with loadmat is the slowest part of any analysis, so convert() does it once and stores every signal of all the
+steps concatenated into one .npy file, plus the offsets where each step starts and the step metadata. load() then
+memory-maps the cache and every step is a zero-copy view. The steps are also indexed by comment and type, so queries
+such as all the reference discharges are a dictionary lookup returning a view of the step numbers.
+"""
+from scipy.io import loadmat
+import json
+import os
+import numpy as np
+
+CACHE_VERSION = 2
+
+# Per-step vectors concatenated into one array each, per-step metadata and the metadata indexed
+SIGNALS = ('relativeTime', 'time', 'voltage', 'current', 'temperature')
+METADATA = ('comment', 'type', 'date')
+INDEXED = ('comment', 'type')
+
+
+def default_cache_path(mat_path):
+    return os.path.splitext(mat_path)[0] + '.cache'
+
+
+def convert(mat_path, cache_path=None):
+    """
+    Parses a RW .mat file and writes its columnar cache.
+    :param mat_path:    path to the .mat file.
+    :param cache_path:  directory of the cache. By default, the .mat path with a .cache extension.
+    :return:    the cache directory.
+    """
+    if cache_path is None:
+        cache_path = default_cache_path(mat_path)
+    os.makedirs(cache_path, exist_ok=True)
+
+    x = loadmat(mat_path)
+    steps = x['data']['step'][0][0][0]
+    number_of_steps = np.size(steps)
+
+    # Concatenated signals and the offsets of every step into them
+    lengths = np.array([np.size(steps['voltage'][i]) for i in range(0, number_of_steps)], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    np.save(os.path.join(cache_path, 'offsets.npy'), offsets)
+
+    signals = [name for name in SIGNALS if name in steps.dtype.names]
+    for name in signals:
+        column = np.concatenate([np.ravel(steps[name][i]).astype(float) for i in range(0, number_of_steps)])
+        np.save(os.path.join(cache_path, name + '.npy'), column)
+
+    # Metadata as fixed-width strings, which can also be memory-mapped
+    for name in METADATA:
+        if name in steps.dtype.names:
+            values = np.array([matlab_string(steps[name][i]) for i in range(0, number_of_steps)], dtype=str)
+            np.save(os.path.join(cache_path, name + '.npy'), values)
+            if name in INDEXED:
+                save_index(cache_path, name, values)
+
+    info = {'version': CACHE_VERSION,
+            'source': os.path.abspath(mat_path),
+            'source_mtime': os.path.getmtime(mat_path),
+            'procedure': matlab_string(x['data']['procedure'][0][0]),
+            'description': matlab_string(x['data']['description'][0][0]),
+            'signals': signals}
+    with open(os.path.join(cache_path, 'info.json'), 'w') as file_handle:
+        json.dump(info, file_handle, indent=2)
+
+    return cache_path
+
+
+def load(path, cache_path=None):
+    """
+    Opens a RW dataset from its cache, converting the .mat file first if there is no up-to-date cache.
+    :param path:    path to the .mat file or to a cache directory.
+    :param cache_path:  cache directory of a .mat path. By default, the .mat path with a .cache extension.
+    :return:    a RandomWalkDataset.
+    """
+    if os.path.isdir(path):
+        return RandomWalkDataset(path)
+
+    if cache_path is None:
+        cache_path = default_cache_path(path)
+    if not is_cache_valid(cache_path, path):
+        convert(path, cache_path)
+    return RandomWalkDataset(cache_path)
+
+
+def save_index(cache_path, name, values):
+    # Step numbers grouped by value, in CSR layout: the steps with keys[j] are index[offsets[j]:offsets[j + 1]]
+    keys, inverse = np.unique(values, return_inverse=True)
+    index = np.argsort(inverse, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(inverse, minlength=np.size(keys)))])
+    np.save(os.path.join(cache_path, name + '_keys.npy'), keys)
+    np.save(os.path.join(cache_path, name + '_index.npy'), index)
+    np.save(os.path.join(cache_path, name + '_index_offsets.npy'), offsets)
+
+
+def segment_trapezoid(y, x, offsets, steps):
+    """
+    Trapezoidal integral of y over x within each of the given steps of concatenated signals, all at once. The samples
+    of the steps are gathered, integrated with one cumulative sum and the integral of each step is the difference of
+    the sum between its last and first samples, so no pair of samples across two steps contributes.
+    :param y:   concatenated integrand.
+    :param x:   concatenated abscissa.
+    :param offsets: step i spans offsets[i]:offsets[i + 1].
+    :param steps:   step numbers to integrate.
+    :return:    one integral per step (0 for steps with less than two samples).
+    """
+    steps = np.asarray(steps, dtype=np.int64)
+    starts = offsets[steps]
+    lengths = offsets[steps + 1] - starts
+    first = np.cumsum(lengths) - lengths
+
+    # Positions of the selected samples in the concatenated signals
+    idx = np.arange(np.sum(lengths)) + np.repeat(starts - first, lengths)
+    ys = y[idx]
+    xs = x[idx]
+    cumulative = np.concatenate([[0.0], np.cumsum(0.5 * (ys[1:] + ys[:-1]) * np.diff(xs))])
+
+    last = np.maximum(first + lengths - 1, first)
+    integral = np.zeros(np.size(steps))
+    valid = lengths > 1
+    integral[valid] = cumulative[last[valid]] - cumulative[first[valid]]
+    return integral
+
+
+def reference_capacity(dataset, comment='reference discharge'):
+    """
+    Capacity measured in every reference discharge of a cell: the integral of the current over time in Ah.
+    :param dataset: a RandomWalkDataset.
+    :param comment: comment of the reference discharge steps.
+    :return:    (step numbers, capacities in Ah).
+    """
+    steps = dataset.select(comment=comment)
+    return steps, dataset.integrate('current', steps) / 3600.0
+
+
+def is_cache_valid(cache_path, mat_path):
+    try:
+        with open(os.path.join(cache_path, 'info.json'), 'r') as file_handle:
+            info = json.load(file_handle)
+    except (OSError, ValueError):
+        return False
+    return info.get('version') == CACHE_VERSION and info.get('source_mtime') == os.path.getmtime(mat_path)
+
+
+def matlab_string(value):
+    # Content of a MATLAB char array as loaded by loadmat, '' if it is empty
+    value = np.ravel(value)
+    if np.size(value) == 0:
+        return ''
+    return str(value[0])
+
+
+class RandomWalkDataset:
+    def __init__(self, cache_path):
+        """
+        Memory-mapped RW dataset. signals['voltage'] etc. hold the concatenated vectors of all steps and step i spans
+        offsets[i]:offsets[i + 1] of them. comment, type and date hold one entry per step.
+        :param cache_path:  directory written by convert().
+        """
+        self.cachePath = cache_path
+        with open(os.path.join(cache_path, 'info.json'), 'r') as file_handle:
+            self.info = json.load(file_handle)
+        self.procedure = self.info['procedure']
+        self.description = self.info['description']
+
+        self.offsets = self.open('offsets')
+        self.signals = {name: self.open(name) for name in self.info['signals']}
+        self.comment = self.open('comment')
+        self.type = self.open('type')
+        self.date = self.open('date')
+
+        # Step index by comment and by type
+        self.index = {name: StepIndex(self.open(name + '_keys'), self.open(name + '_index'),
+                                      self.open(name + '_index_offsets'))
+                      for name in INDEXED if self.open(name + '_keys') is not None}
+
+    def open(self, name):
+        file_path = os.path.join(self.cachePath, name + '.npy')
+        if not os.path.exists(file_path):
+            return None
+        return np.load(file_path, mmap_mode='r')
+
+    def __len__(self):
+        return np.size(self.offsets) - 1
+
+    @property
+    def numberOfSteps(self):
+        return len(self)
+
+    def signal(self, name, i):
+        # View of one signal of step i
+        return self.signals[name][self.offsets[i]:self.offsets[i + 1]]
+
+    def select(self, comment=None, type=None):
+        """
+        Step numbers with the given comment and/or type, e.g. select(comment='reference discharge') or
+        select(type='D'). A single criterion returns a read-only view of the index.
+        """
+        selected = None
+        for name, key in (('comment', comment), ('type', type)):
+            if key is None:
+                continue
+            steps = self.index[name].lookup(key)
+            selected = steps if selected is None else np.intersect1d(selected, steps)
+        if selected is None:
+            return np.arange(len(self))
+        return selected
+
+    def integrate(self, name, steps, x='relativeTime'):
+        # Trapezoidal integral of a signal over x within each of the given steps
+        return segment_trapezoid(self.signals[name], self.signals[x], self.offsets, steps)
+
+    def signals_of(self, name, steps):
+        # Views of one signal for each of the given steps
+        return [self.signal(name, i) for i in steps]
+
+    def step(self, i):
+        # Views of every signal of step i plus its metadata
+        step = {name: self.signal(name, i) for name in self.signals}
+        for name in METADATA:
+            values = getattr(self, name)
+            if values is not None:
+                step[name] = str(values[i])
+        return step
+
+
+class StepIndex:
+    def __init__(self, keys, index, offsets):
+        # Map from a metadata value to its steps, a slice of the grouped step numbers
+        self.index = index
+        self.ranges = {str(key): (offsets[j], offsets[j + 1]) for j, key in enumerate(keys)}
+
+    def keys(self):
+        return list(self.ranges.keys())
+
+    def lookup(self, key):
+        start, stop = self.ranges.get(key, (0, 0))
+        return self.index[start:stop]
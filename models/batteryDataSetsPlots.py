@@ -1,43 +1,36 @@
 import res.ukf
-from scipy.io import loadmat
+from res import plotting
+from data import nasa
 import os
 import matplotlib.pyplot as plt
 import numpy as np
 
 # %% md
-# Load data
-x = loadmat('../data/NASA_datasets/'
-            'Battery_Uniform_Distribution_Charge_Discharge_DataSet_2Post/'
-            'data/Matlab/RW9.mat')
+# Load data. The .mat file is parsed only the first time, later runs memory-map its cache
+dataset = nasa.load('../data/NASA_datasets/'
+                    'Battery_Uniform_Distribution_Charge_Discharge_DataSet_2Post/'
+                    'data/Matlab/RW9.mat')
 
 # %% md
-# Save to variables and then use them IMPORTANT: [i][j][0] will lead to the content ([0]) of row i, column j
-data = x['data']
-
-print('Procedure:\n', x['data']['procedure'][0][0][0])
-print('Description:\n', x['data']['description'][0][0][0])
-
-steps = x['data']['step'][0][0][0]
+# Every step is a set of views into the concatenated signals: dataset.signal(name, i)
+print('Procedure:\n', dataset.procedure)
+print('Description:\n', dataset.description)
 
 # %% md An example of the low current discharge data
-inds = []
-
-for i, commentArr in enumerate(steps['comment']):
-    if commentArr[0] == 'low current discharge at 0.04A':
-        inds.append(i)
+inds = dataset.select(comment='low current discharge at 0.04A')
 
-RT = steps['relativeTime'][inds[0]][0] / 3600.0
-V = steps['voltage'][inds[0]][0]
-I = steps['current'][inds[0]][0]
+RT = dataset.signal('relativeTime', inds[0]) / 3600.0
+V = dataset.signal('voltage', inds[0])
+I = dataset.signal('current', inds[0])
 
 plt.subplot(121)
-plt.plot(RT, V)
+plotting.plot(RT, V)
 plt.title('Voltage for low current discharge')
 plt.xlabel('Time (h)')
 plt.ylabel('Voltage (V)')
 
 plt.subplot(122)
-plt.plot(RT, I)
+plotting.plot(RT, I)
 plt.title('Current for low current discharge')
 plt.xlabel('Time (h)')
 plt.ylabel('Voltage (V)')
@@ -46,12 +39,11 @@ plt.show()
 
 # %% md Next, the constant load profiles that are run after every 50 random walk
 
-for i, commentArr in enumerate(steps['comment']):
-    if commentArr[0] == 'reference discharge':
-        RT = steps['relativeTime'][i][0] / 3600.0
-        V = steps['voltage'][i][0]
-        I = steps['current'][i][0]
-        plt.plot(RT, V, 'k')
+for i in dataset.select(comment='reference discharge'):
+    RT = dataset.signal('relativeTime', i) / 3600.0
+    V = dataset.signal('voltage', i)
+    I = dataset.signal('current', i)
+    plotting.plot(RT, V, 'k')
 
 plt.xlim([-.1, 2.5])
 plt.ylim([3, 4.25])
@@ -64,14 +56,8 @@ plt.show()
 # %% md We can benchmark the battery’s capacity by integrating current over the
 # reference cycles. The next plot shows this capacity measurement vs date.
 
-date = []
-capacity = []
-for i, commentArr in enumerate(steps['comment']):
-    if commentArr[0] == 'reference discharge':
-        # date.append(steps['date'][i][0])
-        date.append(i)
-        capacity.append(np.trapz(steps['current'][i][0],
-                        x=steps['relativeTime'][i][0] / 3600.0))
+# All reference discharges are integrated at once over the concatenated signals
+date, capacity = nasa.reference_capacity(dataset)
 
 plt.plot(date, capacity, 'o')
 plt.xlabel('Date')
@@ -1,5 +1,5 @@
 import res.ukf
-from scipy.io import loadmat
+from data import nasa
 import os
 import matplotlib.pyplot as plt
 import numpy as np
@@ -24,17 +24,12 @@ def observationModel(x0):
 
 
 # %% md
-# Load data
-x = loadmat('../data/NASA_datasets/'
-            'Battery_Uniform_Distribution_Charge_Discharge_DataSet_2Post/'
-            'data/Matlab/RW9.mat')
+# Load data. The .mat file is parsed only the first time, later runs memory-map its cache
+dataset = nasa.load('../data/NASA_datasets/'
+                    'Battery_Uniform_Distribution_Charge_Discharge_DataSet_2Post/'
+                    'data/Matlab/RW9.mat')
 
 # %% md
-# Save to variables and then use them IMPORTANT: [i][j][0] will lead to the content
-# ([0]) of row i, column j
-data = x['data']
-
-print('Procedure:\n', x['data']['procedure'][0][0][0])
-print('Description:\n', x['data']['description'][0][0][0])
-
-steps = x['data']['step'][0][0][0]
+# Every step is a set of views into the concatenated signals: dataset.signal(name, i)
+print('Procedure:\n', dataset.procedure)
+print('Description:\n', dataset.description)
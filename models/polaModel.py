@@ -0,0 +1,110 @@
+import collections
+
+import numpy as np
+
+
+class PolaModel:
+    def __init__(self, alpha=0.0053193, beta=11.505, gamma=1.5538, vo=41.405, vl=33.481, Ecrit=1389900.0, dt=1.0):
+        """
+        Pola battery pack model with state x = [R, SOC] (internal resistance and state of charge) and input
+        u = [V, I]. The SOC decreases with the delivered energy and the terminal voltage is the open circuit
+        voltage minus the resistive drop:
+
+            SOC+ = SOC - V * I * dt / Ecrit
+            V = vl + (vo - vl) exp(gamma (SOC - 1)) + alpha vl (SOC - 1)
+                + (1 - alpha) vl (exp(-beta) - exp(-beta sqrt(SOC))) - I R
+
+        Every constant of these expressions is computed once here. The kernels accept one state per column and any
+        number of leading batch dimensions (x of shape (..., 2, m), u of shape (..., 2, 1) or (..., 2, m)), so the
+        bound methods plug into UnscentedKalmanFilter(vectorized=True, input_at_output=True) and
+        UnscentedKalmanFilterBank. The scratch buffers make an instance unsafe to share between threads; only the
+        most recently used shapes are kept, and they are not pickled with the model.
+        :param alpha:   linear OCV coefficient.
+        :param beta:    low-SOC exponential OCV coefficient.
+        :param gamma:   high-SOC exponential OCV coefficient.
+        :param vo:  voltage at full charge in V.
+        :param vl:  voltage at the linear zone in V.
+        :param Ecrit:   usable energy of the pack in J.
+        :param dt:  sample time in seconds.
+        """
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.vo = vo
+        self.vl = vl
+        self.Ecrit = Ecrit
+        self.dt = dt
+
+        # Invariants
+        self.energyFactor = dt / Ecrit
+        self.exponentialFactor = (vo - vl) * np.exp(-gamma)
+        self.linearFactor = alpha * vl
+        self.lowSocFactor = -(1 - alpha) * vl
+        self.constant = vl - alpha * vl + (1 - alpha) * vl * np.exp(-beta)
+
+        # Scratch buffers by shape, least recently used first
+        self.buffers = collections.OrderedDict()
+        self.maxBuffers = 8
+
+    def process(self, x, u, out=None):
+        if out is None:
+            out = np.empty(np.broadcast_shapes(np.shape(x), np.shape(u)[:-2] + np.shape(x)[-2:]))
+        work = self.buffer(np.shape(out[..., 1:2, :]))
+
+        np.copyto(out, x)
+        np.multiply(u[..., 0:1, :], u[..., 1:2, :], out=work)
+        np.multiply(work, self.energyFactor, out=work)
+        np.subtract(out[..., 1:2, :], work, out=out[..., 1:2, :])
+        return out
+
+    def observation(self, x, u, out=None):
+        if out is None:
+            out = np.empty(np.broadcast_shapes(np.shape(x[..., 1:2, :]), np.shape(u[..., 1:2, :])))
+        self.openCircuitVoltage(x[..., 1:2, :], out=out)
+
+        work = self.buffer(np.shape(out))
+        np.multiply(u[..., 1:2, :], x[..., 0:1, :], out=work)
+        np.subtract(out, work, out=out)
+        return out
+
+    def openCircuitVoltage(self, soc, out=None):
+        if out is None:
+            out = np.empty(np.shape(soc))
+        work = self.buffer(np.shape(out))
+
+        # (1 - alpha) vl exp(-beta sqrt(SOC)) term
+        np.sqrt(soc, out=work)
+        np.multiply(work, -self.beta, out=work)
+        np.exp(work, out=work)
+        np.multiply(work, self.lowSocFactor, out=out)
+
+        # (vo - vl) exp(gamma (SOC - 1)) term
+        np.multiply(soc, self.gamma, out=work)
+        np.exp(work, out=work)
+        np.multiply(work, self.exponentialFactor, out=work)
+        np.add(out, work, out=out)
+
+        # alpha vl SOC term and constants
+        np.multiply(soc, self.linearFactor, out=work)
+        np.add(out, work, out=out)
+        np.add(out, self.constant, out=out)
+        return out
+
+    def buffer(self, shape):
+        work = self.buffers.get(shape)
+        if work is None:
+            # Batches that change width (e.g. trajectories retired in the prognostics) would otherwise keep one
+            # buffer per width
+            work = np.empty(shape)
+            self.buffers[shape] = work
+            if len(self.buffers) > self.maxBuffers:
+                self.buffers.popitem(last=False)
+        else:
+            self.buffers.move_to_end(shape)
+        return work
+
+    def __getstate__(self):
+        # Scratch buffers are not sent along with the bound kernels to worker processes
+        state = self.__dict__.copy()
+        state['buffers'] = collections.OrderedDict()
+        return state
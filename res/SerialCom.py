@@ -5,7 +5,9 @@ import time
 import sys
 import signal
 import numpy as np
-import pandas as pd
+
+from res.measurements import MeasurementWriter
+from res.sampling import DeadlineSampler
 
 # User defined variables
 serial_port = 'COM1'
@@ -16,19 +18,104 @@ def signal_handler():
     print('\nfinishing')
 
 
+def build_transaction(commands):
+    """
+    Packs several SCPI commands and queries into a single message. Every command is rooted with ':' so that it does
+    not depend on the subsystem of the previous one; common commands (*OPC?, *RST...) are joined as they are.
+    :param commands:    iterable of SCPI commands, e.g. ['CHAN 1', 'MEAS:VOLT?', 'MEAS:CURR?'].
+    :return:    the message to be written, without terminator.
+    """
+    message = ''
+    for cmd in commands:
+        if message:
+            message += ';' if cmd.startswith(('*', ':')) else ';:'
+        message += cmd
+    return message
+
+
+def count_queries(commands):
+    return sum(1 for cmd in commands if cmd.endswith('?'))
+
+
+def parse_reply(reply, number_of_values):
+    """
+    Splits the reply of a transaction into the answer of every query.
+    :param reply:   the reply line, with the answers separated by ';'.
+    :param number_of_values:    number of queries of the transaction.
+    :return:    list with the answer of every query, or None if the reply is missing or incomplete.
+    """
+    if reply is None or reply == "Timeout":
+        return None
+    values = [value.strip() for value in reply.split(';')]
+    if len(values) != number_of_values:
+        return None
+    return values
+
+
+def snapshot_commands(channels):
+    # Pack voltage once, then the current of every channel
+    commands = []
+    for i, channel in enumerate(channels):
+        commands.append('CHAN ' + str(channel))
+        if i == 0:
+            commands.append('MEAS:VOLT?')
+        commands.append('MEAS:CURR?')
+    return commands
+
+
+def current_commands(channels, value):
+    # Splits the pack current evenly among the channels and turns them on in constant current mode
+    value_per_channel = value / len(channels)
+    commands = []
+    for channel in channels:
+        commands += ['CHAN ' + str(channel), 'INPUT OFF', 'FUNC CURR', 'CURR:RANG MAX',
+                     'CURR ' + str(value_per_channel), 'INPUT ON']
+    return commands
+
+
+def input_commands(channels, state):
+    commands = []
+    for channel in channels:
+        commands += ['CHAN ' + str(channel), 'INPUT ON' if state else 'INPUT OFF']
+    return commands
+
+
+def parse_snapshot(values):
+    """
+    Converts the answers of a snapshot transaction.
+    :return:    voltage and list of currents of every channel, or None if the transaction failed.
+    """
+    if values is None:
+        return None
+    try:
+        values = [float(value) for value in values]
+    except ValueError:
+        return None
+    return values[0], values[1:]
+
+
 # Classes
 class SerialConfig:
-    def __init__(self, baud_rate=9600, port="COM1", time_out=1, sleep_time=.07):
+    def __init__(self, baud_rate=9600, port="COM1", time_out=1, sleep_time=.07, terminator='\n', poll_time=.01,
+                 synchronize=True):
         """
         A class to store serial communication info.
         :param baud_rate:   communication baud rate. By default 9600.
         :param port:    the port where the serial device is connected to. By default 'COM1'
-        :param time_out:    communiaction timeout in seconds. By default 1 second.
+        :param time_out:    communiaction timeout in seconds. By default 1 second. It is the default deadline of every
+                            command: the reply is returned as soon as the terminator arrives.
+        :param sleep_time:  settling time after writes when synchronize is False.
+        :param terminator:  the line terminator of the instrument replies. By default '\\n'.
+        :param poll_time:   read timeout of the port in seconds. It only bounds how late a deadline is detected.
+        :param synchronize: if True, writes are confirmed with *OPC? instead of waiting sleep_time.
         """
         self.baud_rate = baud_rate
         self.port = port
         self.timeout = time_out  # 1 segundo de timeout
         self.sleep_time = sleep_time
+        self.terminator = terminator
+        self.poll_time = poll_time
+        self.synchronize = synchronize
 
 
 class LoadConfig:
@@ -49,15 +136,19 @@ class ElectronicLoad:
         # The path where measurements will be stored
         self.measurement_folder_path = measurement_folder_path
         self.measurement_file_name = measurement_file_name
-        self.measurement_file_path = self.measurement_folder_path + self.measurement_file_name + ".csv"
+        self.measurement_file_path = self.measurement_folder_path + self.measurement_file_name + ".bin"
         print('Data will be saved to:\n', self.measurement_file_path)
 
         # Serial communication handlers
-        self.serial = serial.Serial()
+        # Any pyserial URL is accepted besides device names, e.g. 'loop://' or 'socket://host:port'
+        self.serial = serial.serial_for_url(config_serial.port, do_not_open=True)
         self.serial.baudrate = config_serial.baud_rate
-        self.serial.port = config_serial.port
-        self.serial.timeout = config_serial.timeout
+        self.serial.timeout = min(config_serial.poll_time, config_serial.timeout)
         self.serial_sleep_time = config_serial.sleep_time
+        self.command_timeout = config_serial.timeout
+        self.terminator = bytes(config_serial.terminator, 'utf-8')
+        self.synchronize = config_serial.synchronize
+        self.rx_buffer = bytearray()
 
         # Set Load Config
         self.load = config_load
@@ -89,22 +180,65 @@ class ElectronicLoad:
             cmd = 'hello'
             self._send(cmd)
 
-    def _request(self, cmd):
-        to_send = bytes(cmd + "\n", 'utf-8')
-        self.serial.write(to_send)
-        time.sleep(self.serial_sleep_time)  # FIXME this takes too much time, what's the real solution?
-        out = ''
-        while self.serial.in_waiting > 0:
-            out = self.serial.readline().decode("utf-8")[0:-2]
-        if out != '':
+    def _write(self, cmd):
+        self.serial.write(bytes(cmd + "\n", 'utf-8'))
+
+    def _read_response(self, timeout=None):
+        """
+        Reads one reply, returning as soon as the terminator arrives.
+        :param timeout: deadline in seconds for this reply. By default the one of the serial configuration.
+        :return:    the reply without the terminator, or None if the deadline expired.
+        """
+        deadline = time.monotonic() + (self.command_timeout if timeout is None else timeout)
+        while True:
+            end = self.rx_buffer.find(self.terminator)
+            if end >= 0:
+                reply = self.rx_buffer[:end].decode("utf-8").strip()
+                del self.rx_buffer[:end + len(self.terminator)]
+                return reply
+
+            if time.monotonic() >= deadline:
+                # A late reply would be taken as the answer of the next request, so everything pending is dropped
+                self.serial.reset_input_buffer()
+                self.rx_buffer.clear()
+                return None
+
+            # Blocks until at least one byte arrives or the port poll time expires
+            self.rx_buffer += self.serial.read(max(self.serial.in_waiting, 1))
+
+    def _request(self, cmd, timeout=None):
+        self._write(cmd)
+        out = self._read_response(timeout)
+        if out:
             return out
         else:
             return "Timeout"
 
-    def _send(self, cmd):
-        to_send = bytes(cmd + "\n", 'utf-8')
-        self.serial.write(to_send)
-        time.sleep(self.serial_sleep_time)  # FIXME this takes too much time, what's the real solution?
+    def _send(self, cmd, timeout=None):
+        """
+        Sends a command. When synchronization is enabled it waits until the instrument reports the command as
+        completed, otherwise it waits the configured settling time.
+        :return:    False if the instrument did not confirm the command before the deadline.
+        """
+        if not self.synchronize:
+            self._write(cmd)
+            time.sleep(self.serial_sleep_time)
+            return True
+        return self._request(cmd + ';*OPC?', timeout) == '1'
+
+    def transaction(self, commands, timeout=None):
+        """
+        Executes several commands and queries in one round trip.
+        :param commands:    list of SCPI commands and queries.
+        :param timeout: deadline in seconds for the whole transaction. By default the one of the serial configuration.
+        :return:    list with the answer of every query (empty if there are none), or None if the instrument did not
+                    answer in time.
+        """
+        message = build_transaction(commands)
+        number_of_queries = count_queries(commands)
+        if number_of_queries == 0:
+            return [] if self._send(message, timeout) else None
+        return parse_reply(self._request(message, timeout), number_of_queries)
 
     def set_channel(self, channel):
         self._send('CHAN ' + str(channel))
@@ -117,49 +251,44 @@ class ElectronicLoad:
         meas = self._request("MEAS:CURR?")
         return meas
 
+    def read_snapshot(self, channels=None):
+        """
+        Reads the pack voltage and the current of every channel in a single transaction.
+        :param channels:    channels to read. By default the ones of the load configuration.
+        :return:    voltage and list of currents, or None if the instrument did not answer in time.
+        """
+        channels = self.load.channels if channels is None else channels
+        return parse_snapshot(self.transaction(snapshot_commands(channels)))
+
     def read_voltage(self):
         #channels = self.load.channels
         channels = [1]  # FIXME a trick
-        meas = [0] * len(channels)
-        for i, channel in enumerate(channels):
-            self._send('CHAN ' + str(channel))
-            meas[i] = self._request("MEAS:VOLT?")
-        return meas
+        meas = self.transaction([cmd for channel in channels for cmd in ('CHAN ' + str(channel), 'MEAS:VOLT?')])
+        return meas if meas is not None else ["Timeout"] * len(channels)
+
+    def read_current(self):
+        channels = self.load.channels
+        meas = self.transaction([cmd for channel in channels for cmd in ('CHAN ' + str(channel), 'MEAS:CURR?')])
+        return meas if meas is not None else ["Timeout"] * len(channels)
 
     def read_voltage_single_channel(self, channel):
-        self._send('CHAN ' + str(channel))
-        meas = self._request("MEAS:VOLT?")
-        return meas
+        return self.read_single_channel(channel, "MEAS:VOLT?")
 
     def read_current_single_channel(self, channel):
-        self._send('CHAN ' + str(channel))
-        meas = self._request("MEAS:CURR?")
-        return meas
+        return self.read_single_channel(channel, "MEAS:CURR?")
+
+    def read_single_channel(self, channel, query):
+        meas = self.transaction(['CHAN ' + str(channel), query])
+        return meas[0] if meas is not None else "Timeout"
 
     def set_current(self, val):
-        channels = self.load.channels
-        val_per_channel = val/len(channels)
-        for channel in channels:
-            self._send('CHAN ' + str(channel))
-            self._send('INPUT OFF; FUNC CURR')
-            self._send('CURR:RANG MAX')
-            self._send('CURR ' + str(val_per_channel))
-            self._send('INPUT ON')
-        return
+        return self.transaction(current_commands(self.load.channels, val)) is not None
 
     def turn_all_input_on(self):
-        channels = (1, 2, 3)
-        for channel in channels:
-            self._send('CHAN ' + str(channel))
-            self._send('INPUT ON')
-        return
+        return self.transaction(input_commands((1, 2, 3), True)) is not None
 
     def turn_all_input_off(self):
-        channels = (1, 2, 3)
-        for channel in channels:
-            self._send('CHAN ' + str(channel))
-            self._send('INPUT OFF')
-        return
+        return self.transaction(input_commands((1, 2, 3), False)) is not None
 
     def periodic_measurement(self, sample_time=1):
         """
@@ -169,26 +298,21 @@ class ElectronicLoad:
         :return:
         """
         channels = self.load.channels
-        # Initialize first values and append
-        t0 = time.time()
-        t0_global = t0
+        columns = ('t', 'V') + tuple('I' + str(channel) for channel in channels)
+        sampler = DeadlineSampler(sample_time)
 
         # Iterate until user press ctrl+c or voltage is above discharge voltage
-        while True:
-            t1 = time.time()
-            if t1 - t0 >= sample_time:
-                t = t1 - t0_global
-                data = {'t': [t]}
-                voltage_list = self.read_voltage()*3    # FIXME a trick
-                current_list = self.read_current()
-                for channel, voltage, current in zip(channels, voltage_list, current_list):
-                    data['V CH' + str(channel)] = [voltage]
-                    data['I CH' + str(channel)] = [current]
-                df = pd.DataFrame(data)
-                print(df)
-                df.to_csv(self.measurement_file_path, index=None, header=False, mode='a')
-
-                if float(voltage_list[0]) <= self.load.discharge_voltage:
+        with MeasurementWriter(self.measurement_file_path, columns=columns) as writer:
+            while True:
+                t = sampler.wait()
+                snapshot = self.read_snapshot(channels)
+                if snapshot is None:
+                    continue
+                voltage, currents = snapshot
+                writer.append(t, voltage, *currents)
+                print('%.1f s\t%.3f V\t' % (t, voltage) + '\t'.join('%.3f A' % current for current in currents))
+
+                if voltage <= self.load.discharge_voltage:
                     break
-                t0 = time.time()
+        print(sampler.statistics())
         return
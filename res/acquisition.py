@@ -0,0 +1,389 @@
+# Asynchronous acquisition from the electronic load
+
+import asyncio
+import collections
+import functools
+import time
+
+from res.SerialCom import ElectronicLoad, build_transaction, count_queries, parse_reply, snapshot_commands, \
+    parse_snapshot, current_commands, input_commands
+from res.sampling import DeadlineSampler
+
+# One sample of the pack: t is the instant the snapshot was requested, relative to the start of the acquisition
+Measurement = collections.namedtuple('Measurement', ['k', 't', 'voltage', 'currents'])
+
+# Samples of every instrument of a rig for deadline k, at t = k sample_time. Missing samples are None
+RigMeasurement = collections.namedtuple('RigMeasurement', ['k', 't', 'measurements'])
+
+
+class SerialTransport:
+    def __init__(self, serial_port, terminator=b'\n', timeout=1.0):
+        """
+        Non-blocking request/reply access to an open serial port. On POSIX the port descriptor is watched by the event
+        loop, so waiting for a reply costs nothing. Where the loop cannot watch the port (Windows COM ports, URL
+        handlers without descriptor) the blocking reads run in the default executor instead.
+        :param serial_port: an open pyserial port.
+        :param terminator:  the line terminator of the replies.
+        :param timeout: default deadline in seconds of every request.
+        """
+        self.serial = serial_port
+        self.terminator = terminator
+        self.timeout = timeout
+        self.rx_buffer = bytearray()
+        self.replies = collections.deque()
+        self.reply_event = None
+        self.loop = None
+        self.watching = False
+
+    def open(self):
+        # Must be called from the event loop that will use the transport
+        self.loop = asyncio.get_running_loop()
+        self.reply_event = asyncio.Event()
+        self.serial.reset_input_buffer()
+        try:
+            self.loop.add_reader(self.serial.fileno(), self._on_readable)
+            self.watching = True
+        except (AttributeError, NotImplementedError):
+            self.watching = False
+
+    def close(self):
+        if self.watching:
+            self.loop.remove_reader(self.serial.fileno())
+            self.watching = False
+
+    def _on_readable(self):
+        self.rx_buffer += self.serial.read(max(self.serial.in_waiting, 1))
+        self._split_replies()
+
+    def _split_replies(self):
+        end = self.rx_buffer.find(self.terminator)
+        while end >= 0:
+            self.replies.append(self.rx_buffer[:end].decode("utf-8").strip())
+            del self.rx_buffer[:end + len(self.terminator)]
+            end = self.rx_buffer.find(self.terminator)
+        if self.replies:
+            self.reply_event.set()
+
+    def _read_blocking(self, timeout):
+        # Executor fallback. The port read timeout bounds how long every read blocks
+        deadline = time.monotonic() + timeout
+        while not self.replies and time.monotonic() < deadline:
+            self.rx_buffer += self.serial.read(max(self.serial.in_waiting, 1))
+            end = self.rx_buffer.find(self.terminator)
+            if end >= 0:
+                self.replies.append(self.rx_buffer[:end].decode("utf-8").strip())
+                del self.rx_buffer[:end + len(self.terminator)]
+
+    async def _next_reply(self):
+        while not self.replies:
+            self.reply_event.clear()
+            await self.reply_event.wait()
+
+    def write(self, message):
+        self.serial.write(bytes(message + "\n", 'utf-8'))
+
+    async def request(self, message, timeout=None):
+        """
+        Writes a message and waits for its reply.
+        :return:    the reply without terminator, or None if it did not arrive before the deadline.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        self.replies.clear()
+        self.write(message)
+
+        if self.watching:
+            try:
+                await asyncio.wait_for(self._next_reply(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await self.loop.run_in_executor(None, self._read_blocking, timeout)
+
+        if self.replies:
+            return self.replies.popleft()
+
+        # A late reply would be taken as the answer of the next request, so everything pending is dropped
+        self.serial.reset_input_buffer()
+        self.rx_buffer.clear()
+        return None
+
+
+class AsyncElectronicLoad:
+    def __init__(self, electronic_load: ElectronicLoad):
+        """
+        Coroutine version of the ElectronicLoad transactions. It shares the port and the configuration of the
+        synchronous instance, which must not be used while the asynchronous one is open.
+        """
+        self.electronic_load = electronic_load
+        self.transport = SerialTransport(electronic_load.serial, electronic_load.terminator,
+                                         electronic_load.command_timeout)
+
+    def open(self):
+        self.electronic_load.rx_buffer.clear()
+        self.transport.open()
+
+    def close(self):
+        self.transport.close()
+
+    async def transaction(self, commands, timeout=None):
+        message = build_transaction(commands)
+        number_of_queries = count_queries(commands)
+        if number_of_queries > 0:
+            return parse_reply(await self.transport.request(message, timeout), number_of_queries)
+
+        if self.electronic_load.synchronize:
+            return [] if await self.transport.request(message + ';*OPC?', timeout) == '1' else None
+        self.transport.write(message)
+        await asyncio.sleep(self.electronic_load.serial_sleep_time)
+        return []
+
+    async def read_snapshot(self, channels=None):
+        channels = self.electronic_load.load.channels if channels is None else channels
+        return parse_snapshot(await self.transaction(snapshot_commands(channels)))
+
+    async def set_current(self, val):
+        return await self.transaction(current_commands(self.electronic_load.load.channels, val)) is not None
+
+    async def turn_all_input_off(self):
+        return await self.transaction(input_commands((1, 2, 3), False)) is not None
+
+
+class AcquisitionEngine:
+    def __init__(self, electronic_load: ElectronicLoad, sample_time=1.0, channels=None, controller=None):
+        """
+        Samples the pack on absolute deadlines and hands every measurement to the registered consumers, which run as
+        concurrent tasks fed through their own queues. Waiting for the deadline and for the instrument does not use
+        the CPU, so logging, filtering or plotting consumers run in the meantime.
+        :param electronic_load: the instrument.
+        :param sample_time: sample time in seconds.
+        :param channels:    channels to read. By default the ones of the load configuration.
+        :param controller:  callable (or coroutine function) receiving every measurement within the acquisition loop.
+                            The acquisition stops when it returns False. By default it stops at the discharge voltage.
+        """
+        self.load = AsyncElectronicLoad(electronic_load)
+        self.sample_time = sample_time
+        self.channels = electronic_load.load.channels if channels is None else channels
+        if controller is None:
+            discharge_voltage = electronic_load.load.discharge_voltage
+            controller = lambda measurement: measurement.voltage > discharge_voltage
+        self.controller = controller
+
+        self.consumers = []
+        self.queues = []
+        self.running = False
+        self.sampler = None
+
+        # Statistics. Missed deadlines and timestamp errors are kept by the sampler
+        self.samples = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def add_consumer(self, handler, maxsize=0):
+        """
+        Registers a consumer. With maxsize > 0 the queue is bounded and measurements that do not fit are dropped (and
+        counted) instead of delaying the acquisition.
+        :param handler: callable or coroutine function receiving every measurement.
+        """
+        self.consumers.append((handler, maxsize))
+
+    def stop(self):
+        self.running = False
+
+    def publish(self, measurement):
+        for queue in self.queues:
+            try:
+                queue.put_nowait(measurement)
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+    async def control(self, measurement):
+        result = self.controller(measurement)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result is not False
+
+    async def run(self, t0=None):
+        """
+        Runs the acquisition until the controller or stop() ends it. A consumer that raises also ends it, and its
+        exception is raised once every consumer has finished and the port is released.
+        :param t0:  monotonic instant of the first deadline. By default now.
+        """
+        self.load.open()
+        self.queues = [asyncio.Queue(maxsize) for _, maxsize in self.consumers]
+        tasks = [asyncio.ensure_future(consume(queue, handler))
+                 for queue, (handler, _) in zip(self.queues, self.consumers)]
+
+        for task in tasks:
+            task.add_done_callback(self.consumer_done)
+
+        self.sampler = DeadlineSampler(self.sample_time, t0)
+        self.running = True
+        try:
+            while self.running:
+                t = await self.sampler.wait_async()
+                snapshot = await self.load.read_snapshot(self.channels)
+                if snapshot is None:
+                    self.failed += 1
+                    continue
+
+                voltage, currents = snapshot
+                measurement = Measurement(self.sampler.k - 1, t, voltage, tuple(currents))
+                self.samples += 1
+                self.publish(measurement)
+                if not await self.control(measurement):
+                    break
+        finally:
+            self.running = False
+            for queue, task in zip(self.queues, tasks):
+                await finish_consumer(queue, task)
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            self.load.close()
+
+        # Raised once the port is released, so the caller can still turn the inputs off
+        raise_consumer_error(results)
+
+    def consumer_done(self, task):
+        # A consumer that fails stops the acquisition instead of silently losing its measurements
+        if not task.cancelled() and task.exception() is not None:
+            self.stop()
+
+
+async def finish_consumer(queue, task):
+    # Sends the end of acquisition sentinel. A consumer that already ended leaves nobody to make room in a full
+    # queue, so the put is abandoned as soon as its task is done
+    if task.done():
+        return
+    put = asyncio.ensure_future(queue.put(None))
+    await asyncio.wait([put, task], return_when=asyncio.FIRST_COMPLETED)
+    if not put.done():
+        put.cancel()
+
+
+def raise_consumer_error(results):
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+
+def print_measurement(measurement):
+    print('%.1f s\t%.3f V\t' % (measurement.t, measurement.voltage) +
+          '\t'.join('%.3f A' % current for current in measurement.currents))
+
+
+async def consume(queue, handler):
+    # Feeds a handler until the end of acquisition sentinel arrives
+    while True:
+        measurement = await queue.get()
+        if measurement is None:
+            return
+        result = handler(measurement)
+        if asyncio.iscoroutine(result):
+            await result
+
+
+class AcquisitionCoordinator:
+    def __init__(self, engines, stop_together=True):
+        """
+        Runs several acquisition engines, one per serial port, concurrently in one event loop. They share t0, so
+        deadline k is the same monotonic instant for every instrument, and their samples are merged into a single
+        stream of RigMeasurement. While one instrument waits for its reply the others are being read, so the rig
+        throughput grows with the number of ports. Row k is emitted as soon as every instrument is past deadline k,
+        so an instrument that keeps failing only leaves None in its column.
+        :param engines: AcquisitionEngine of every instrument, all with the same sample time.
+        :param stop_together:   if True, the acquisition of every instrument stops when one of them stops.
+        """
+        self.engines = list(engines)
+        self.sample_time = self.engines[0].sample_time
+        if any(engine.sample_time != self.sample_time for engine in self.engines):
+            raise ValueError('Every engine must have the same sample time')
+        self.stop_together = stop_together
+
+        self.consumers = []
+        self.queues = []
+        self.pending = dict()
+        self.rows = 0
+        self.incomplete = 0
+        self.dropped = 0
+
+        for instrument, engine in enumerate(self.engines):
+            engine.add_consumer(functools.partial(self.collect, instrument))
+
+    def add_consumer(self, handler, maxsize=0):
+        # Handlers receive every RigMeasurement, see AcquisitionEngine.add_consumer
+        self.consumers.append((handler, maxsize))
+
+    def stop(self):
+        for engine in self.engines:
+            engine.stop()
+
+    def settled(self):
+        # Deadlines below this index are over for every instrument, whether their reads succeeded or not: a running
+        # engine is reading deadline sampler.k - 1 or waiting for sampler.k, and a stopped one adds nothing
+        settled = float('inf')
+        for engine in self.engines:
+            if engine.sampler is None:
+                return 0
+            if engine.running:
+                settled = min(settled, engine.sampler.k - 1)
+        return settled
+
+    def collect(self, instrument, measurement):
+        row = self.pending.get(measurement.k)
+        if row is None:
+            row = self.pending[measurement.k] = [None] * len(self.engines)
+        row[instrument] = measurement
+
+        # Every instrument samples in deadline order, so once row k is complete no earlier row can grow
+        last = measurement.k if all(sample is not None for sample in row) else -1
+        last = max(last, self.settled() - 1)
+        while self.pending:
+            k = min(self.pending)
+            if k > last:
+                break
+            self.emit(k, self.pending.pop(k))
+
+    def emit(self, k, row):
+        self.rows += 1
+        if any(sample is None for sample in row):
+            self.incomplete += 1
+        rig_measurement = RigMeasurement(k, k * self.sample_time, tuple(row))
+        for queue in self.queues:
+            try:
+                queue.put_nowait(rig_measurement)
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+    async def run(self, t0=None):
+        """
+        Runs the acquisition of every instrument. Errors of the engines and of the consumers are raised once every
+        acquisition has ended.
+        :param t0:  monotonic instant of the first deadline. By default now.
+        """
+        self.queues = [asyncio.Queue(maxsize) for _, maxsize in self.consumers]
+        tasks = [asyncio.ensure_future(consume(queue, handler))
+                 for queue, (handler, _) in zip(self.queues, self.consumers)]
+        for task in tasks:
+            task.add_done_callback(self.consumer_done)
+
+        t0 = time.monotonic() if t0 is None else t0
+        acquisitions = [asyncio.ensure_future(engine.run(t0)) for engine in self.engines]
+        try:
+            if self.stop_together:
+                await asyncio.wait(acquisitions, return_when=asyncio.FIRST_COMPLETED)
+                self.stop()
+            await asyncio.gather(*acquisitions)
+        finally:
+            self.stop()
+            await asyncio.gather(*acquisitions, return_exceptions=True)
+            for k in sorted(self.pending):
+                self.emit(k, self.pending.pop(k))
+            for queue, task in zip(self.queues, tasks):
+                await finish_consumer(queue, task)
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        raise_consumer_error(results)
+
+    def consumer_done(self, task):
+        # See AcquisitionEngine.consumer_done
+        if not task.cancelled() and task.exception() is not None:
+            self.stop()
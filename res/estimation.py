@@ -0,0 +1,130 @@
+# Online state of charge estimation on the acquisition stream
+
+import asyncio
+import time
+import numpy as np
+
+from models.polaModel import PolaModel
+from res.ukf import UnscentedKalmanFilter
+
+# Columns of the estimate files: sample time, state, covariance, whether the measurement update ran and its duration
+ESTIMATE_COLUMNS = ('t', 'R', 'SOC', 'P_R', 'P_R_SOC', 'P_SOC', 'updated', 'step_time')
+
+
+class OnlineSocEstimator:
+    def __init__(self, ukf: UnscentedKalmanFilter, writer=None, latency_budget=0.5):
+        """
+        Runs a Pola-model UKF on the samples of an AcquisitionEngine as they arrive, as the consumer of its own queue.
+        Filter steps run in the default executor so that a slow step never delays sampling. The input of step k is
+        [V_k, I_k], with I_k the sum of the channel currents, and its measurement V_k+1, as in batteryModel_Pola.py;
+        the model dt must equal the sample time.
+        Filtering degrades instead of stalling:
+            - a sample older than latency_budget when its turn comes only propagates the state (x = f(x, u),
+              P = P + Q, exact for the Pola model, whose process Jacobian is the identity),
+            - samples dropped by a full queue or skipped by the sampler are propagated the same way,
+            - a step that fails or gives a non-finite estimate is discarded and replaced by a propagation.
+        :param ukf: UnscentedKalmanFilter with a vectorized PolaModel, input_at_output=True. Its step() is used.
+        :param writer:  MeasurementWriter with columns ESTIMATE_COLUMNS where every estimate is recorded.
+        :param latency_budget:  maximum age in seconds of a sample whose measurement update is still run.
+        """
+        self.ukf = ukf
+        self.writer = writer
+        self.latency_budget = latency_budget
+        self.engine = None
+
+        # The filter state is written in place from here on
+        self.ukf.x0 = np.array(ukf.x0, dtype=float)
+        self.ukf.p0 = np.array(ukf.p0, dtype=float)
+        self.u = np.zeros((2, 1))
+        self.y = np.zeros((1, 1))
+        self.last_k = None
+
+        # Statistics
+        self.updates = 0
+        self.predictions = 0
+        self.failures = 0
+        self.step_time_max = 0.0
+
+    def attach(self, engine, maxsize=0):
+        """
+        Registers the estimator as a consumer of an AcquisitionEngine.
+        :param maxsize: size of its queue. With maxsize > 0 the engine drops the samples that do not fit.
+        """
+        self.engine = engine
+        engine.add_consumer(self.process_measurement, maxsize)
+
+    @property
+    def x(self):
+        return self.ukf.x0
+
+    @property
+    def p(self):
+        return self.ukf.p0
+
+    def predict(self):
+        self.ukf.processFunction(self.ukf.x0, self.u, out=self.ukf.x0)
+        np.add(self.ukf.p0, self.ukf.processNoise, out=self.ukf.p0)
+        self.predictions += 1
+
+    def update(self):
+        x_backup = self.ukf.x0.copy()
+        p_backup = self.ukf.p0.copy()
+        try:
+            x, p = self.ukf.step(self.u, self.y)
+            if np.all(np.isfinite(x)) and np.all(np.isfinite(p)):
+                self.updates += 1
+                return True
+        except np.linalg.LinAlgError:
+            pass
+
+        # Back to the previous estimate, only propagated
+        self.failures += 1
+        np.copyto(self.ukf.x0, x_backup)
+        np.copyto(self.ukf.p0, p_backup)
+        self.predict()
+        return False
+
+    async def process_measurement(self, measurement):
+        if self.last_k is not None:
+            # Samples that never arrived keep the last input
+            for _ in range(measurement.k - self.last_k - 1):
+                self.predict()
+
+            # Age of the sample relative to its acquisition instant
+            age = time.monotonic() - self.engine.sampler.t0 - measurement.t if self.engine is not None else 0.0
+            start = time.perf_counter()
+            if age <= self.latency_budget:
+                self.y[0, 0] = measurement.voltage
+                updated = await asyncio.get_running_loop().run_in_executor(None, self.update)
+            else:
+                self.predict()
+                updated = False
+            step_time = time.perf_counter() - start
+            self.step_time_max = max(self.step_time_max, step_time)
+
+            if self.writer is not None:
+                x, p = self.ukf.x0, self.ukf.p0
+                self.writer.append(measurement.t, x[0, 0], x[1, 0], p[0, 0], p[0, 1], p[1, 1], updated, step_time)
+
+        self.u[0, 0] = measurement.voltage
+        self.u[1, 0] = sum(measurement.currents)
+        self.last_k = measurement.k
+
+    def statistics(self):
+        return {'updates': self.updates, 'predictions': self.predictions, 'failures': self.failures,
+                'step_time_max': self.step_time_max}
+
+
+def pola_soc_estimator(model: PolaModel, x0, p0, process_noise, observation_noise, writer=None, latency_budget=0.5):
+    """
+    OnlineSocEstimator with the Pola filter of batteryModel_Pola.py: vectorized model, input at the output and no
+    recycled sigma points.
+    :param model:   PolaModel with dt equal to the sample time.
+    :param x0:  initial state [R, SOC].
+    :param p0:  initial covariance.
+    """
+    ukf = UnscentedKalmanFilter(model.process, np.reshape(x0, (2, 1)), p0, h=model.observation,
+                                process_noise=process_noise, observation_noise=observation_noise,
+                                uk0=np.vstack([model.vo, 0.0]), input_at_output=True, recycle_sigma_points=False,
+                                kappa=1.0, vectorized=True)
+    return OnlineSocEstimator(ukf, writer=writer, latency_budget=latency_budget)
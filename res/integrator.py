@@ -0,0 +1,77 @@
+import numpy as np
+
+
+class TrapezoidalIntegrator:
+    def __init__(self, channels=1):
+        # Running trapezoidal integral of one or several channels sampled at arbitrary instants. Each update costs O(1)
+        # and uses the actual time elapsed since the previous sample
+        self.channels = channels
+        self.value = np.zeros(channels)
+        self.lastTime = None
+        self.lastSample = np.zeros(channels)
+        self.samples = 0
+
+    def update(self, t, sample):
+        # Adds the area between the previous sample and this one and returns the integral up to t
+        if self.lastTime is not None:
+            dt = t - self.lastTime
+            self.value += 0.5 * dt * self.lastSample
+            self.value += 0.5 * dt * np.asarray(sample)
+        self.lastTime = t
+        self.lastSample[:] = sample
+        self.samples += 1
+        return self.value
+
+    def reset(self):
+        self.value[:] = 0.0
+        self.lastTime = None
+        self.samples = 0
+
+
+class EnergyChargeIntegrator:
+    def __init__(self, channels=1):
+        # Charge (A s) of every current channel and energy (J) delivered through each of them at the pack voltage
+        self.charge = TrapezoidalIntegrator(channels)
+        self.energy = TrapezoidalIntegrator(channels)
+        self.power = np.zeros(channels)
+
+    def update(self, t, voltage, currents):
+        """
+        Integrates one sample.
+        :param t:   sample instant in seconds.
+        :param voltage: pack voltage in V.
+        :param currents:    current of every channel in A (I1, I2, I3...).
+        """
+        np.multiply(voltage, currents, out=self.power)
+        self.charge.update(t, currents)
+        self.energy.update(t, self.power)
+
+    def reset(self):
+        self.charge.reset()
+        self.energy.reset()
+
+    @property
+    def totalCharge(self):
+        # Charge of all channels in A s
+        return float(np.sum(self.charge.value))
+
+    @property
+    def totalChargeAh(self):
+        return self.totalCharge / 3600.0
+
+    @property
+    def totalEnergy(self):
+        # Energy of all channels in J
+        return float(np.sum(self.energy.value))
+
+    def stateOfCharge(self, Ecrit):
+        # SOC left from a full charge of Ecrit J, as the energy-based ground truth SOC
+        return 1 - self.totalEnergy / Ecrit
+
+
+def cumulativeTrapezoid(y, t):
+    # Batch counterpart of TrapezoidalIntegrator: integral of y (samples along the first axis) up to every instant
+    y = np.asarray(y, dtype=float)
+    dt = np.diff(np.asarray(t, dtype=float))
+    increments = 0.5 * (y[1:] + y[:-1]) * np.reshape(dt, (-1,) + (1,) * (np.ndim(y) - 1))
+    return np.concatenate([np.zeros((1,) + np.shape(y)[1:]), np.cumsum(increments, axis=0)])
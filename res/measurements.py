@@ -0,0 +1,100 @@
+# Binary measurement files
+
+import json
+import os
+import time
+import numpy as np
+
+MAGIC = b'BDPMEAS1'
+DTYPE = '<f8'
+# Length of the JSON header, little-endian like the records
+LENGTH_DTYPE = '<u4'
+
+
+class MeasurementWriter:
+    def __init__(self, path, columns=('t', 'V', 'I1', 'I2', 'I3'), buffer_size=1024, flush_interval=1.0,
+                 fsync_interval=10.0):
+        """
+        Stores measurements as fixed width float64 records after a small JSON header. Samples are copied into a
+        preallocated buffer and written in batches, so appending one costs a row assignment instead of a file open.
+        Records reach the OS at least every flush_interval seconds and the disk every fsync_interval seconds; after a
+        crash the file holds everything up to the last flush.
+        :param path:    file to create. An existing file is overwritten.
+        :param columns: names of the columns of every record.
+        :param buffer_size: number of records buffered between writes.
+        :param flush_interval:  maximum time in seconds a record stays in the buffer.
+        :param fsync_interval:  time in seconds between fsync calls.
+        """
+        self.path = path
+        self.columns = tuple(columns)
+        self.buffer = np.empty((buffer_size, len(self.columns)), dtype=DTYPE)
+        self.count = 0
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+
+        header = json.dumps({'columns': self.columns, 'dtype': DTYPE}).encode('utf-8')
+        header += b' ' * (-(len(MAGIC) + 4 + len(header)) % 8)
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC + np.array(len(header), dtype=LENGTH_DTYPE).tobytes() + header)
+        self.file.flush()
+
+        self.last_flush = time.monotonic()
+        self.last_sync = self.last_flush
+
+    def append(self, *values):
+        # One value per column
+        self.buffer[self.count] = values
+        self.count += 1
+        if self.count == len(self.buffer) or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def write_measurement(self, measurement):
+        # Handler for AcquisitionEngine consumers: t, voltage and the current of every channel
+        self.append(measurement.t, measurement.voltage, *measurement.currents)
+
+    def flush(self):
+        self.file.write(self.buffer[:self.count].data)
+        self.file.flush()
+        self.count = 0
+        self.last_flush = time.monotonic()
+        if self.last_flush - self.last_sync >= self.fsync_interval:
+            os.fsync(self.file.fileno())
+            self.last_sync = self.last_flush
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_header(file_handle):
+    if file_handle.read(len(MAGIC)) != MAGIC:
+        raise ValueError(file_handle.name + ' is not a measurement file')
+    length = int(np.frombuffer(file_handle.read(4), dtype=LENGTH_DTYPE)[0])
+    return json.loads(file_handle.read(length).decode('utf-8'))
+
+
+def read_measurements(path):
+    """
+    Loads a measurement file written by MeasurementWriter. A trailing partial record, left by an interrupted write,
+    is ignored.
+    :param path:    the measurement file.
+    :return:    dictionary with one array per column.
+    """
+    with open(path, 'rb') as file_handle:
+        header = read_header(file_handle)
+        data = file_handle.read()
+
+    columns = header['columns']
+    record_size = np.dtype(header['dtype']).itemsize * len(columns)
+    data = np.frombuffer(data, dtype=header['dtype'], count=len(data) // record_size * len(columns))
+    data = data.reshape(-1, len(columns))
+    return {name: np.ascontiguousarray(data[:, i]) for i, name in enumerate(columns)}
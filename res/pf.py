@@ -0,0 +1,140 @@
+import numpy as np
+
+
+class ParticleFilter:
+    def __init__(self, f, x0, p0, h=None, process_noise=None, observation_noise=None, uk0=None,
+                 number_of_particles=10000, input_at_output=False, resample_threshold=0.5, seed=None):
+        # Bootstrap particle filter with the calling convention of UnscentedKalmanFilter(vectorized=True): f(X, u) and
+        # h(X) (or h(X, u)) receive all particles as an (n, N) matrix, one particle per column. Particles are drawn
+        # from N(x0, p0). Resampling is systematic and triggered when the effective sample size falls below
+        # resample_threshold * N (0 never resamples, 1 resamples at every step)
+        self.processFunction = f
+        self.x0 = x0
+        self.p0 = p0
+
+        if h is None:
+            self.observationFunction = lambda x: x
+
+        else:
+            self.observationFunction = h
+
+        self.inputAtOutput = input_at_output
+        self.numberOfParticles = number_of_particles
+        self.resampleThreshold = resample_threshold
+        self.stateDimension = np.size(x0)
+        self.rng = np.random.default_rng(seed)
+
+        # Initial input
+        if uk0 is None:
+            self.uk0 = np.vstack([.0])
+        else:
+            self.uk0 = np.vstack([uk0])
+
+        # Calculated from inputs
+        if input_at_output:
+            self.outputDimension = np.size(self.observationFunction(x0, self.uk0))
+        else:
+            self.outputDimension = np.size(self.observationFunction(x0))
+
+        # Covariance matrices
+        if process_noise is None:
+            self.processNoise = np.eye(self.stateDimension)
+        else:
+            self.processNoise = process_noise
+
+        if observation_noise is None:
+            self.observationNoise = np.eye(self.outputDimension)
+        else:
+            self.observationNoise = observation_noise
+        self.updateNoiseFactors()
+
+        # Particles and normalized weights
+        self.particles = x0 + np.matmul(np.linalg.cholesky(p0),
+                                        self.rng.standard_normal((self.stateDimension, number_of_particles)))
+        self.weights = np.full(number_of_particles, 1.0 / number_of_particles)
+        self.logWeights = np.zeros(number_of_particles)
+        self.effectiveSampleSize = float(number_of_particles)
+        self.resampled = False
+
+    def updateNoiseFactors(self):
+        # Cholesky factor of Q to draw process noise and inverse factor of R to evaluate the likelihood
+        self.sqrtProcessNoise = np.linalg.cholesky(self.processNoise)
+        self.invSqrtObservationNoise = np.linalg.inv(np.linalg.cholesky(self.observationNoise))
+
+    def predict(self, uk0):
+        # Propagates every particle through f and adds process noise
+        self.uk0 = uk0
+        self.particles = self.processFunction(self.particles, uk0) + \
+            np.matmul(self.sqrtProcessNoise, self.rng.standard_normal((self.stateDimension, self.numberOfParticles)))
+        return self.particles
+
+    def update(self, yk1):
+        # Reweights particles with the Gaussian likelihood of yk1, in log space to avoid underflow. Particles whose
+        # output is not finite (e.g. SOC below zero in the Pola model) get zero weight
+        if self.inputAtOutput:
+            Y = self.observationFunction(self.particles, self.uk0)
+        else:
+            Y = self.observationFunction(self.particles)
+        e = np.matmul(self.invSqrtObservationNoise, yk1 - Y)
+        logLikelihood = -0.5 * np.einsum('ij,ij->j', e, e)
+        logWeights = self.logWeights + np.where(np.isfinite(logLikelihood), logLikelihood, -np.inf)
+        maxLogWeight = np.max(logWeights)
+        if not np.isfinite(maxLogWeight):
+            raise np.linalg.LinAlgError('No particle has a finite likelihood')
+
+        self.logWeights = logWeights - maxLogWeight
+        self.weights = np.exp(self.logWeights)
+        self.weights /= np.sum(self.weights)
+        self.effectiveSampleSize = 1.0 / np.sum(self.weights ** 2)
+        return self.weights
+
+    def resample(self):
+        # Systematic resampling: N evenly spaced pointers with one random offset into the weights CDF
+        idx = systematicResample(self.weights, self.rng)
+        self.particles = self.particles[:, idx]
+        self.weights = np.full(self.numberOfParticles, 1.0 / self.numberOfParticles)
+        self.logWeights = np.zeros(self.numberOfParticles)
+        return idx
+
+    def estimate(self):
+        # Weighted mean and covariance of the particles
+        x = np.matmul(self.particles, self.weights)[:, np.newaxis]
+        dX = self.particles - x
+        P = np.matmul(dX * self.weights, dX.T)
+        return x, P
+
+    def aPosterioriEstimation(self, uk0, yk1, process_noise=None, observation_noise=None):
+        # Update process and observation noises
+        if process_noise is not None:
+            self.processNoise = process_noise
+
+        if observation_noise is not None:
+            self.observationNoise = observation_noise
+
+        if process_noise is not None or observation_noise is not None:
+            self.updateNoiseFactors()
+
+        self.predict(uk0)
+        self.update(yk1)
+        xk1, Pk1 = self.estimate()
+
+        # Resample after estimating, so the estimate uses the full weighted set
+        self.resampled = self.effectiveSampleSize < self.resampleThreshold * self.numberOfParticles
+        if self.resampled:
+            self.resample()
+
+        self.x0 = xk1
+        self.p0 = Pk1
+
+        return xk1, Pk1
+
+
+def systematicResample(weights, rng=None):
+    # Indexes of the particles kept by systematic resampling of normalized weights
+    if rng is None:
+        rng = np.random.default_rng()
+    N = np.size(weights)
+    cdf = np.cumsum(weights)
+    cdf[-1] = 1.0
+    positions = (rng.random() + np.arange(N)) / N
+    return np.searchsorted(cdf, positions, side='right')
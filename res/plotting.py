@@ -0,0 +1,71 @@
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+class DownsampledLine:
+    def __init__(self, ax, x, y, line, max_points=4000):
+        # Keeps the full resolution trace and only hands matplotlib the min/max envelope of the visible range. The
+        # envelope is recomputed whenever the x limits change, so zooming in reveals the raw samples
+        self.ax = ax
+        self.x = x
+        self.y = y
+        self.line = line
+        self.max_points = max_points
+        # matplotlib only keeps weak references to bound methods, so the callback is a closure that keeps the
+        # object alive for as long as the axes are, even if the caller drops it
+        self.callback = ax.callbacks.connect('xlim_changed', lambda axes: self.update(axes))
+
+    def update(self, ax=None):
+        x0, x1 = self.ax.get_xlim()
+        i0 = max(np.searchsorted(self.x, x0, side='left') - 1, 0)
+        i1 = min(np.searchsorted(self.x, x1, side='right') + 1, len(self.x))
+        index = minMaxIndex(self.y[i0:i1], self.max_points // 2) + i0
+        self.line.set_data(self.x[index], self.y[index])
+
+    def disconnect(self):
+        self.ax.callbacks.disconnect(self.callback)
+
+
+def minMaxIndex(y, number_of_buckets):
+    # Indexes of the minimum and maximum of y in each of number_of_buckets contiguous buckets, in time order. The first
+    # and last samples are always kept so the drawn trace spans the same range as the raw one
+    n = len(y)
+    if n <= 2 * number_of_buckets + 2:
+        return np.arange(n)
+
+    size = -(-n // number_of_buckets)
+    full = n // size
+    buckets = y[:full * size].reshape(full, size)
+    offsets = np.arange(full) * size
+    lo = np.argmin(buckets, axis=1) + offsets
+    hi = np.argmax(buckets, axis=1) + offsets
+
+    if full * size < n:
+        tail = y[full * size:]
+        lo = np.append(lo, np.argmin(tail) + full * size)
+        hi = np.append(hi, np.argmax(tail) + full * size)
+
+    return np.unique(np.concatenate([[0], lo, hi, [n - 1]]))
+
+
+def plot(x, y=None, fmt=None, ax=None, max_points=4000, **kwargs):
+    """
+    Drop-in replacement of plt.plot for long, monotonic in x traces. Only the min/max envelope of at most max_points
+    samples is drawn, which preserves peaks and the overall shape of the signal.
+    :param x:   sample instants. When y is not given, x is taken as the signal and plotted against the sample index.
+    :param y:   signal.
+    :param fmt: matplotlib format string.
+    :param ax:  axes to plot into. Defaults to the current axes.
+    :param max_points:  maximum number of points handed to matplotlib.
+    :return:    the DownsampledLine, which keeps the envelope updated on zoom and pan.
+    """
+    if y is None or isinstance(y, str):
+        x, y, fmt = np.arange(len(x)), x, y if fmt is None else fmt
+    x = np.asarray(x)
+    y = np.asarray(y)
+    ax = plt.gca() if ax is None else ax
+
+    index = minMaxIndex(y, max_points // 2)
+    args = (x[index], y[index]) if fmt is None else (x[index], y[index], fmt)
+    line, = ax.plot(*args, **kwargs)
+    return DownsampledLine(ax, x, y, line, max_points)
@@ -0,0 +1,158 @@
+# Declarative current profiles run on the acquisition engine
+
+import asyncio
+import numpy as np
+
+from res.SerialCom import ElectronicLoad
+from res.acquisition import AcquisitionEngine, print_measurement
+from res.integrator import EnergyChargeIntegrator
+
+
+class ProfileStage:
+    def __init__(self, points, repetitions=1, charge_limit=None, name=None):
+        """
+        A stage of a current profile.
+        :param points:  list of (end time, current) as the point lists of the experiment tools: every current is held
+                        until its end time in seconds, counted from the start of the repetition. An end time of
+                        float('inf') holds the current until a stop condition ends the stage.
+        :param repetitions: number of times the points are run. None repeats them until a stop condition.
+        :param charge_limit:    cumulative pack charge in Ah, counted from the start of the profile, that ends the
+                                stage.
+        :param name:    printed when the stage starts.
+        """
+        self.ends = np.array([end for end, _ in points], dtype=float)
+        self.currents = np.array([current for _, current in points], dtype=float)
+        if len(self.ends) == 0 or self.ends[0] <= 0 or np.any(np.diff(self.ends) <= 0):
+            raise ValueError('End times must be positive and increasing')
+        self.period = self.ends[-1]
+        self.repetitions = repetitions
+        self.charge_limit = charge_limit
+        self.name = name
+
+
+class CurrentProfile:
+    def __init__(self, stages, cutoff_voltage=None, charge_limit=None):
+        """
+        Stages run one after another. The profile ends when the last stage does or when a global stop condition is met.
+        :param stages:  list of ProfileStage.
+        :param cutoff_voltage:  pack voltage in V that ends the profile. By default the discharge voltage of the load.
+        :param charge_limit:    cumulative pack charge in Ah that ends the profile.
+        """
+        self.stages = list(stages)
+        self.cutoff_voltage = cutoff_voltage
+        self.charge_limit = charge_limit
+
+
+class ProfileExecutor:
+    def __init__(self, electronic_load: ElectronicLoad, profile: CurrentProfile, sample_time=1.0, writer=None,
+                 integrator: EnergyChargeIntegrator = None, estimator=None, echo=True):
+        """
+        Runs a current profile on an AcquisitionEngine. The schedule is advanced and the stop conditions are checked in
+        the engine controller, after every sample and with O(1) work; setpoints are only sent when they change.
+        Logging and printing run as engine consumers.
+        :param electronic_load: the instrument.
+        :param profile: the profile to run.
+        :param sample_time: sample time in seconds. Setpoints change on sample boundaries.
+        :param writer:  MeasurementWriter where the samples are stored.
+        :param integrator:  charge and energy integrator. By default a new one for the channels of the load.
+        :param estimator:   OnlineSocEstimator fed with every sample through its own bounded queue.
+        :param echo:    if True, every sample and stage is printed.
+        """
+        self.electronic_load = electronic_load
+        self.profile = profile
+        self.sample_time = sample_time
+        self.cutoff_voltage = electronic_load.load.discharge_voltage if profile.cutoff_voltage is None \
+            else profile.cutoff_voltage
+        self.integrator = EnergyChargeIntegrator(len(electronic_load.load.channels)) if integrator is None \
+            else integrator
+        self.echo = echo
+
+        self.engine = AcquisitionEngine(electronic_load, sample_time, controller=self.control)
+        if writer is not None:
+            self.engine.add_consumer(writer.write_measurement)
+        if echo:
+            self.engine.add_consumer(print_measurement)
+        if estimator is not None:
+            estimator.attach(self.engine, maxsize=16)
+
+        # Schedule state
+        self.stage_index = 0
+        self.segment = 0
+        self.repetition = 0
+        self.stage_start = 0.0
+        self.setpoint = None
+        self.reason = None
+
+    def start_stage(self, stage_index, t):
+        self.stage_index = stage_index
+        self.segment = 0
+        self.repetition = 0
+        self.stage_start = t
+        if self.echo and stage_index < len(self.profile.stages) and self.profile.stages[stage_index].name:
+            print("########### " + self.profile.stages[stage_index].name + " ###########")
+
+    def advance(self, t):
+        """
+        Moves the schedule to the instant t, relative to the first sample.
+        :return:    False if the profile is completed.
+        """
+        while self.stage_index < len(self.profile.stages):
+            stage = self.profile.stages[self.stage_index]
+            if stage.charge_limit is None or self.integrator.totalChargeAh < stage.charge_limit:
+                while t - self.stage_start >= stage.ends[self.segment]:
+                    if self.segment + 1 < len(stage.ends):
+                        self.segment += 1
+                    elif stage.repetitions is None or self.repetition + 1 < stage.repetitions:
+                        self.repetition += 1
+                        self.segment = 0
+                        self.stage_start += stage.period
+                    else:
+                        break
+                else:
+                    return True
+            self.start_stage(self.stage_index + 1, t)
+        return False
+
+    @property
+    def current(self):
+        stage = self.profile.stages[self.stage_index]
+        return stage.currents[self.segment]
+
+    def finish(self, reason):
+        self.reason = reason
+        return False
+
+    async def control(self, measurement):
+        self.integrator.update(measurement.t, measurement.voltage, measurement.currents)
+        if measurement.voltage <= self.cutoff_voltage:
+            return self.finish('cutoff voltage')
+        if self.profile.charge_limit is not None and self.integrator.totalChargeAh >= self.profile.charge_limit:
+            return self.finish('charge limit')
+
+        # Setpoint of the next sample
+        if not self.advance((measurement.k + 1) * self.sample_time):
+            return self.finish('profile completed')
+        if self.current != self.setpoint:
+            # A setpoint the instrument did not confirm is sent again after the next sample
+            self.setpoint = self.current if await self.engine.load.set_current(self.current) else None
+        return True
+
+    async def execute(self):
+        self.start_stage(0, 0.0)
+        if not self.advance(0.0):
+            self.reason = 'profile completed'
+            return self.reason
+
+        try:
+            self.setpoint = self.current if self.electronic_load.set_current(self.current) else None
+            await self.engine.run()
+        finally:
+            self.electronic_load.turn_all_input_off()
+        return self.reason
+
+    def run(self):
+        """
+        Runs the profile until it is completed or a stop condition is met. The inputs are turned off at the end.
+        :return:    the reason the profile ended: 'profile completed', 'cutoff voltage' or 'charge limit'.
+        """
+        return asyncio.run(self.execute())
@@ -0,0 +1,137 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+
+from res.ukf import batchedSqrtm
+
+
+class EndOfDischargePredictor:
+    def __init__(self, f, h, discharge_voltage, process_noise=None, dt=1.0, number_of_workers=None,
+                 samples_per_task=1000):
+        """
+        Monte Carlo end-of-discharge (EOD) prediction. Trajectories start from samples of a filter posterior and are
+        propagated with the vectorized process and observation functions used by the filters (one state per column),
+        with input u = [V, I] as in the Pola model: the voltage fed to f is the one predicted by h. A trajectory
+        reaches EOD at the first step whose predicted voltage is at or below discharge_voltage.
+
+        Samples are simulated in batches of samples_per_task columns, spread over a process pool that is created on
+        the first prediction and kept until close(). f and h must be picklable (module functions or methods of a
+        model such as PolaModel).
+        :param f:   process function f(X, u).
+        :param h:   observation function h(X, u).
+        :param discharge_voltage:   cutoff voltage in V.
+        :param process_noise:   covariance of the noise added to each transition. None simulates without noise.
+        :param dt:  sample time of the models in seconds.
+        :param number_of_workers:   size of the process pool. 1 simulates in this process. By default, cpu count.
+        :param samples_per_task:    samples simulated by each pool task.
+        """
+        self.processFunction = f
+        self.observationFunction = h
+        self.dischargeVoltage = discharge_voltage
+        self.dt = dt
+        self.samplesPerTask = samples_per_task
+
+        if process_noise is None:
+            self.sqrtProcessNoise = None
+        else:
+            self.sqrtProcessNoise = batchedSqrtm(process_noise)
+
+        if number_of_workers is None:
+            self.numberOfWorkers = os.cpu_count()
+        else:
+            self.numberOfWorkers = number_of_workers
+        self.pool = None
+
+    def predict(self, x0, p0, current_profile, number_of_samples=10000, seed=None):
+        """
+        Predicts the EOD time distribution from the posterior N(x0, p0).
+        :param x0:  posterior mean (n, 1).
+        :param p0:  posterior covariance (n, n).
+        :param current_profile: future current, one value per sample time. Trajectories not discharged by the end of
+                                the profile get an infinite EOD time.
+        :param number_of_samples:   number of simulated trajectories.
+        :param seed:    seed of the sampling and process noise.
+        :return:    an EndOfDischargePrediction.
+        """
+        sequence = np.random.SeedSequence(seed)
+        rng = np.random.default_rng(sequence)
+        n = np.size(x0)
+        X0 = np.reshape(x0, (n, 1)) + np.matmul(batchedSqrtm(p0), rng.standard_normal((n, number_of_samples)))
+        current_profile = np.asarray(current_profile, dtype=float).ravel()
+
+        # One task per batch of samples, each with an independent noise stream
+        batches = np.array_split(X0, max(1, -(-number_of_samples // self.samplesPerTask)), axis=1)
+        seeds = sequence.spawn(len(batches))
+        args = [(self.processFunction, self.observationFunction, batch, current_profile, self.dischargeVoltage,
+                 self.sqrtProcessNoise, batch_seed) for batch, batch_seed in zip(batches, seeds)]
+
+        if self.numberOfWorkers == 1:
+            steps = [simulateEndOfDischarge(*a) for a in args]
+        else:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.numberOfWorkers)
+            steps = list(self.pool.map(simulateEndOfDischarge, *zip(*args)))
+
+        return EndOfDischargePrediction(np.concatenate(steps) * self.dt)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class EndOfDischargePrediction:
+    def __init__(self, times):
+        # EOD time of every trajectory in seconds from the prediction instant, inf if the profile ended before
+        self.times = times
+        self.reached = np.isfinite(times)
+
+    def probabilityBefore(self, t):
+        return np.mean(self.times <= t)
+
+    def percentiles(self, q=(5, 50, 95)):
+        # Percentiles over all trajectories, inf when less than q% of them discharged within the profile. The
+        # empirical quantile avoids interpolating between infinite times, which would give nan
+        return np.percentile(self.times, q, method='inverted_cdf')
+
+    def mean(self):
+        # Mean over the trajectories that discharged within the profile
+        return np.mean(self.times[self.reached])
+
+
+def simulateEndOfDischarge(f, h, X, current_profile, discharge_voltage, sqrt_process_noise=None, seed=None):
+    # Propagates the columns of X under current_profile and returns the EOD step of each one (inf if never reached).
+    # Module level so that it can be sent to pool workers
+    rng = np.random.default_rng(seed)
+    n, m = np.shape(X)
+    eod = np.full(m, np.inf)
+    active = np.arange(m)
+    u = np.zeros((2, m))
+
+    for k, current in enumerate(current_profile):
+        u[1, :] = current
+        u[0, :] = h(X, u)[0, :]
+
+        # Retire discharged trajectories. A non-finite voltage (e.g. a SOC sampled below zero) counts as discharged
+        discharged = ~(u[0, :] > discharge_voltage)
+        if np.any(discharged):
+            eod[active[discharged]] = k
+            keep = ~discharged
+            active = active[keep]
+            X = X[:, keep]
+            u = u[:, keep]
+            if np.size(active) == 0:
+                break
+
+        X = f(X, u)
+        if sqrt_process_noise is not None:
+            X = X + np.matmul(sqrt_process_noise, rng.standard_normal(np.shape(X)))
+
+    return eod
@@ -0,0 +1,89 @@
+# Periodic sampling on absolute deadlines
+
+import asyncio
+import math
+import time
+
+
+class DeadlineSampler:
+    def __init__(self, sample_time, t0=None, skip_missed=True, clock=time.monotonic):
+        """
+        Paces a sampling loop on the absolute deadlines t0 + k sample_time. The reference is never reset after a
+        sample, so instrument latency does not stretch the period: a 1 Hz loop takes 3600 samples per hour as long as
+        every sample fits in its period. Waiting sleeps instead of spinning.
+        :param sample_time: sample time in seconds.
+        :param t0:  clock instant of the first deadline. By default now.
+        :param skip_missed: if True, deadlines that passed by a whole period or more are skipped (and counted) instead
+                            of being sampled in a burst to catch up.
+        :param clock:   monotonic clock in seconds.
+        """
+        self.sample_time = sample_time
+        self.clock = clock
+        self.t0 = clock() if t0 is None else t0
+        self.skip_missed = skip_missed
+        self.k = 0
+        self.target = None
+
+        # Timestamp error statistics, actual minus target instant
+        self.samples = 0
+        self.missed = 0
+        self.error_sum = 0.0
+        self.error_square_sum = 0.0
+        self.error_max = 0.0
+
+    @property
+    def next_target(self):
+        # Time of the next deadline relative to t0
+        return self.k * self.sample_time
+
+    def _next_deadline(self):
+        deadline = self.t0 + self.k * self.sample_time
+        late = self.clock() - deadline
+        if self.skip_missed and late >= self.sample_time:
+            skipped = math.floor(late / self.sample_time)
+            self.missed += skipped
+            self.k += skipped
+            deadline += skipped * self.sample_time
+        return deadline
+
+    def _record(self, deadline):
+        now = self.clock()
+        error = now - deadline
+        self.samples += 1
+        self.error_sum += error
+        self.error_square_sum += error * error
+        self.error_max = max(self.error_max, error)
+        self.target = deadline - self.t0
+        self.k += 1
+        return now - self.t0
+
+    def wait(self):
+        """
+        Sleeps until the next deadline.
+        :return:    the actual instant relative to t0. The target one is kept in self.target.
+        """
+        deadline = self._next_deadline()
+        delay = deadline - self.clock()
+        if delay > 0:
+            time.sleep(delay)
+        return self._record(deadline)
+
+    async def wait_async(self):
+        # Same as wait, letting other tasks run meanwhile
+        deadline = self._next_deadline()
+        delay = deadline - self.clock()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self._record(deadline)
+
+    def statistics(self):
+        """
+        :return:    dictionary with the number of samples, the number of missed deadlines and the mean, standard
+                    deviation and maximum of the timestamp error in seconds.
+        """
+        if self.samples == 0:
+            return {'samples': 0, 'missed': self.missed, 'mean_error': 0.0, 'std_error': 0.0, 'max_error': 0.0}
+        mean = self.error_sum / self.samples
+        variance = max(self.error_square_sum / self.samples - mean * mean, 0.0)
+        return {'samples': self.samples, 'missed': self.missed, 'mean_error': mean, 'std_error': math.sqrt(variance),
+                'max_error': self.error_max}
@@ -0,0 +1,170 @@
+# Software stand-in of the N3300A electronic load
+
+import argparse
+import os
+import select
+import threading
+import time
+import numpy as np
+
+from models.polaModel import PolaModel
+
+
+class N3300ASimulator:
+    def __init__(self, model: PolaModel = None, x0=(0.05, 1.0), latency=0.0, channels=(1, 2, 3), time_scale=1.0):
+        """
+        Answers the SCPI subset used by ElectronicLoad (CHAN, FUNC CURR, CURR:RANG, CURR, INPUT ON/OFF, MEAS:VOLT?,
+        MEAS:CURR?, *OPC?, *IDN?) on a pseudo-terminal, so ElectronicLoad and the acquisition tools run without
+        hardware. The pack is a PolaModel discharged by the sum of the channel currents; it advances with the wall
+        clock, scaled by time_scale, in steps of model.dt. POSIX only.
+        :param model:   the battery pack. By default PolaModel().
+        :param x0:  initial state [R, SOC].
+        :param latency: delay in seconds before every reply.
+        :param channels:    channels of the mainframe.
+        :param time_scale:  simulated seconds per wall clock second.
+        """
+        self.model = PolaModel() if model is None else model
+        self.x = np.array(x0, dtype=float).reshape(2, 1)
+        self.u = np.zeros((2, 1))
+        self.latency = latency
+        self.time_scale = time_scale
+        self.channel = channels[0]
+        self.setpoints = {channel: 0.0 for channel in channels}
+        self.inputs = {channel: False for channel in channels}
+
+        self.port = None
+        self.master = None
+        self.slave = None
+        self.thread = None
+        self.running = False
+        self.last_update = None
+        self.pending_time = 0.0
+        self.lock = threading.Lock()
+
+    def start(self):
+        # tty needs termios, which only exists on POSIX
+        import tty
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.last_update = time.monotonic()
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def serve(self):
+        rx_buffer = bytearray()
+        while self.running:
+            # The timeout only bounds how long stop() waits for the thread
+            if not select.select([self.master], [], [], 0.1)[0]:
+                continue
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            if not data:
+                return
+            rx_buffer += data
+            end = rx_buffer.find(b'\n')
+            while end >= 0:
+                reply = self.execute(rx_buffer[:end].decode('utf-8'))
+                del rx_buffer[:end + 1]
+                if reply is not None:
+                    if self.latency > 0:
+                        time.sleep(self.latency)
+                    os.write(self.master, bytes(reply + '\n', 'utf-8'))
+                end = rx_buffer.find(b'\n')
+
+    def execute(self, message):
+        """
+        Executes one message, which may pack several commands separated by ';'.
+        :return:    the answers of the queries joined by ';', or None if there are no queries.
+        """
+        answers = []
+        with self.lock:
+            self.advance()
+            for cmd in message.split(';'):
+                cmd = cmd.strip().lstrip(':').upper()
+                try:
+                    answer = self.command(cmd)
+                except (ValueError, KeyError):
+                    # Malformed arguments or unknown channels are ignored, as the instrument only queues an error
+                    continue
+                if answer is not None:
+                    answers.append(answer)
+        return ';'.join(answers) if answers else None
+
+    def command(self, cmd):
+        if cmd == '*OPC?':
+            return '1'
+        if cmd == '*IDN?':
+            return 'SIMULATED,N3300A,0,' + type(self.model).__name__
+        if cmd in ('MEAS:VOLT?', 'MEAS:VOLT:DC?'):
+            return '%.5f' % self.voltage()
+        if cmd in ('MEAS:CURR?', 'MEAS:CURR:DC?'):
+            return '%.5f' % self.channel_current(self.channel)
+
+        keyword, _, argument = cmd.partition(' ')
+        if keyword in ('CHAN', 'INST:NSEL'):
+            self.channel = int(argument)
+        elif keyword in ('INPUT', 'INP'):
+            self.inputs[self.channel] = argument in ('ON', '1')
+        elif keyword in ('CURR', 'CURR:LEV'):
+            self.setpoints[self.channel] = float(argument)
+        # FUNC, CURR:RANG and the rest of the subsystems are accepted and ignored
+        return None
+
+    def channel_current(self, channel):
+        return self.setpoints[channel] if self.inputs[channel] else 0.0
+
+    def pack_current(self):
+        return sum(self.channel_current(channel) for channel in self.setpoints)
+
+    def voltage(self):
+        self.u[1, 0] = self.pack_current()
+        return float(self.model.observation(self.x, self.u)[0, 0])
+
+    def advance(self):
+        # Steps the pack model up to the current instant with the load applied since the last command
+        now = time.monotonic()
+        self.pending_time += (now - self.last_update) * self.time_scale
+        self.last_update = now
+        while self.pending_time >= self.model.dt:
+            self.u[0, 0] = self.voltage()
+            self.model.process(self.x, self.u, out=self.x)
+            np.clip(self.x[1], 0.0, 1.0, out=self.x[1])
+            self.pending_time -= self.model.dt
+
+
+if __name__ == "__main__":
+    # Serves until ctrl+c. Point SerialConfig(port=...) of the experiment tools to the printed device
+    parser = argparse.ArgumentParser(description='Simulated N3300A electronic load on a pseudo-terminal')
+    parser.add_argument('--latency', type=float, default=0.005, help='delay in seconds before every reply')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='simulated seconds per wall clock second')
+    args = parser.parse_args()
+
+    with N3300ASimulator(latency=args.latency, time_scale=args.time_scale) as simulator:
+        print('Simulated N3300A at', simulator.port)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
@@ -1,11 +1,17 @@
+from functools import lru_cache
+from inspect import signature
+
 import numpy as np
 from scipy.linalg import sqrtm as msqrt
+from scipy.linalg import lapack
 
 
 class UnscentedKalmanFilter:
     def __init__(self, f, x0, p0, h=None, process_noise=None, observation_noise=None, uk0=None,
-                 recycle_sigma_points=True, kappa=1.0, input_at_output=False):
+                 recycle_sigma_points=True, kappa=1.0, input_at_output=False, vectorized=False):
         # TODO add doc. h=None returns the state (identity)
+        # vectorized=True: f(X, u) and h(X) (or h(X, u)) receive the whole sigma-point matrix, one point per
+        # column, and return all the propagated points as a matrix with the same number of columns
         self.processFunction = f
         self.x0 = x0
         self.p0 = p0
@@ -17,7 +23,15 @@ class UnscentedKalmanFilter:
             self.observationFunction = h
 
         self.recycleSigmaPoints = recycle_sigma_points
+        self.vectorized = vectorized
         self.kappa = kappa
+        self.stateDimension = np.size(x0)
+
+        # Calculated from inputs
+        if input_at_output:
+            self.outputDimension = np.size(self.observationFunction(x0, uk0))
+        else:
+            self.outputDimension = np.size(self.observationFunction(x0))
 
         # Covariance matrices
         if process_noise is None:
@@ -42,13 +56,6 @@ class UnscentedKalmanFilter:
         else:
             self.inputAtOutput = False
 
-        # Calculated from inputs
-        self.stateDimension = np.size(x0)
-        if input_at_output:
-            self.outputDimension = np.size(self.observationFunction(x0, uk0))
-        else:
-            self.outputDimension = np.size(self.observationFunction(x0))
-
         # Create sigma points matrices
         self.X = np.zeros([self.stateDimension, 2 * self.stateDimension + 1])  # stores sigma points
         self.priorX = np.zeros([self.stateDimension, 2 * self.stateDimension + 1])  # stores evaluated sigma points
@@ -84,6 +91,9 @@ class UnscentedKalmanFilter:
         self.pxy = np.zeros((self.stateDimension, self.outputDimension))
         self.kalmanGain = np.zeros((self.stateDimension, self.outputDimension))
 
+        # Work buffers of step(), allocated on its first call
+        self.workspace = None
+
     def updateWeights(self, kappa):
         # Non-extended
         self.kappa = kappa
@@ -133,6 +143,28 @@ class UnscentedKalmanFilter:
                     x_matrix_new[:, 0] - self.sqrtGamma_extended * sP[:, i - self.stateDimension]
         return x_matrix_new
 
+    def evaluateProcess(self, x_matrix, out):
+        if self.vectorized:
+            out[:, :] = self.processFunction(x_matrix, self.uk0)
+        else:
+            for i in range(0, np.size(x_matrix, 1)):
+                out[:, i] = self.processFunction(np.vstack(x_matrix[:, i]), self.uk0)[:, 0]
+        return out
+
+    def evaluateObservation(self, x_matrix, out):
+        if self.vectorized:
+            if self.inputAtOutput:
+                out[:, :] = self.observationFunction(x_matrix, self.uk0)
+            else:
+                out[:, :] = self.observationFunction(x_matrix)
+        else:
+            for i in range(0, np.size(x_matrix, 1)):
+                if self.inputAtOutput:
+                    out[:, i] = self.observationFunction(np.vstack(x_matrix[:, i]), self.uk0)[:, 0]
+                else:
+                    out[:, i] = self.observationFunction(np.vstack(x_matrix[:, i]))[:, 0]
+        return out
+
     def aPosterioriEstimation(self, uk0, yk1, internal=False, process_noise=None, observation_noise=None):
         # Update process and observation noises
         if process_noise is not None:
@@ -148,64 +180,515 @@ class UnscentedKalmanFilter:
         self.unscentedTransform(self.x0, self.p0, self.X)
 
         # Evaluate sigma points
-        for i in range(0, np.size(self.X, 1)):
-            self.priorX[:, i] = self.processFunction(np.vstack(self.X[:, i]), self.uk0)[:, 0]
+        self.evaluateProcess(self.X, self.priorX)
 
         # Obtain prior values
-        self.x1_prior = weightedSum(self.priorX, self.weights)
-        self.p1_prior = np.copy(self.processNoise)
-        for i in range(0, np.size(self.priorX, 1)):
-            v = np.vstack(self.priorX[:, i]) - self.x1_prior
-            self.p1_prior += self.weights[:, i] * np.outer(v, v)
+        if self.vectorized:
+            self.x1_prior = weightedMean(self.priorX, self.weights)
+            self.p1_prior = self.processNoise + weightedCovariance(self.priorX, self.x1_prior, self.weights)
+        else:
+            self.x1_prior = weightedSum(self.priorX, self.weights)
+            self.p1_prior = np.copy(self.processNoise)
+            for i in range(0, np.size(self.priorX, 1)):
+                v = np.vstack(self.priorX[:, i]) - self.x1_prior
+                self.p1_prior += self.weights[:, i] * np.outer(v, v)
 
         # Propagate prediction
         if self.recycleSigmaPoints:
             self.unscentedTransformExtended(self.priorX, self.priorX_extended, self.processNoise)
-            if self.inputAtOutput:
-                for i in range(0, np.size(self.priorX_extended, 1)):
-                    self.priorY_extended[:, i] = self.observationFunction(np.vstack(self.priorX_extended[:, i]),
-                                                                          uk0)[:, 0]
-            else:
-                for i in range(0, np.size(self.priorX_extended, 1)):
-                    self.priorY_extended[:, i] = self.observationFunction(np.vstack(self.priorX_extended[:, i]))[:, 0]
+            sigmaX = self.priorX_extended
+            sigmaY = self.evaluateObservation(self.priorX_extended, self.priorY_extended)
+            weights = self.weights_extended
+        else:
+            sigmaX = self.priorX
+            sigmaY = self.evaluateObservation(self.priorX, self.priorY)
+            weights = self.weights
 
-            self.y_prior = weightedSum(self.priorY_extended, self.weights_extended)
+        # Update equations
+        if self.vectorized:
+            self.y_prior = weightedMean(sigmaY, weights)
+            self.pyy = self.observationNoise + weightedCovariance(sigmaY, self.y_prior, weights)
+            self.pxy = weightedCovariance(sigmaX, self.x1_prior, weights, sigmaY, self.y_prior)
 
         else:
-            if self.inputAtOutput:
-                for i in range(0, np.size(self.priorX, 1)):
-                    self.priorY[:, i] = self.observationFunction(np.vstack(self.priorX[:, i]), uk0)[:, 0]
-            else:
-                for i in range(0, np.size(self.priorX, 1)):
-                    self.priorY[:, i] = self.observationFunction(np.vstack(self.priorX[:, i]))[:, 0]
+            self.y_prior = weightedSum(sigmaY, weights)
+            self.pyy = np.copy(self.observationNoise)
+            self.pxy = np.zeros((self.stateDimension, self.outputDimension))
+
+            for i in range(0, np.size(sigmaY, 1)):
+                v = np.vstack(sigmaY[:, i]) - self.y_prior
+                self.pyy += weights[0, i] * np.outer(v, v)
+
+                w = np.vstack(sigmaX[:, i]) - self.x1_prior
+                self.pxy += weights[0, i] * np.outer(w, v)
+
+        self.kalmanGain = np.matmul(self.pxy, np.linalg.inv(self.pyy))
+        xk1 = self.x1_prior + np.matmul(self.kalmanGain, yk1 - self.y_prior)
+        Pk1 = self.p1_prior - np.matmul(np.matmul(self.kalmanGain, self.pyy), self.kalmanGain.T)
+
+        if internal:
+            self.x0 = xk1
+            self.p0 = Pk1
+
+        return xk1, Pk1
+
+    def step(self, uk0, yk1):
+        # Allocation-free a posteriori estimation with the interface of aPosterioriEstimation(uk0, yk1, internal=True).
+        # Sigma points are spread along the Cholesky factor of p0 (and of the process noise for recycled points)
+        # instead of sqrtm, so on nonlinear models the estimates match SquareRootUnscentedKalmanFilter (to rounding)
+        # rather than aPosterioriEstimation; both agree on linear models. Every intermediate result is written with
+        # out= operations into the buffers of a StepWorkspace created on the first call, and the gain is solved from
+        # the Cholesky factor of pyy. The returned x0 and p0 are those buffers, copy them to keep them across steps.
+        # The step only allocates when f and h do, i.e. unless they are vectorized and accept an out argument
+        if self.workspace is None:
+            self.workspace = StepWorkspace(self)
+        ws = self.workspace
+
+        # Adopt a state or covariance assigned from outside since the last step
+        if self.x0 is not ws.x0:
+            np.copyto(ws.x0, self.x0)
+        if self.p0 is not ws.p0:
+            np.copyto(ws.p0, self.p0)
+
+        # Update input
+        self.uk0 = uk0
+
+        # Obtain sigma points from previous a posteriori estimation
+        np.copyto(ws.sP, ws.p0)
+        choleskyInPlace(ws.sP)
+        np.multiply(ws.sP, self.sqrtGamma, out=ws.scaledSqrtP)
+        np.copyto(ws.XCenter, ws.x0)
+        np.add(ws.x0, ws.scaledSqrtP, out=ws.XPlus)
+        np.subtract(ws.x0, ws.scaledSqrtP, out=ws.XMinus)
+
+        # Evaluate sigma points
+        if ws.processOut:
+            self.processFunction(self.X, self.uk0, out=self.priorX)
+        else:
+            self.evaluateProcess(self.X, self.priorX)
+
+        # Obtain prior values
+        np.matmul(self.priorX, ws.weightsT, out=ws.x1_prior)
+        np.subtract(self.priorX, ws.x1_prior, out=ws.dX)
+        np.multiply(ws.dX, self.weights, out=ws.dXw)
+        np.matmul(ws.dXw, ws.dXT, out=ws.p1_prior)
+        np.add(ws.p1_prior, self.processNoise, out=ws.p1_prior)
 
-            self.y_prior = weightedSum(self.priorY, self.weights)
+        # Propagate prediction
+        if self.recycleSigmaPoints:
+            if self.processNoise is not ws.processNoise:
+                ws.updateProcessNoise(self.processNoise, self.sqrtGamma_extended)
+            np.copyto(ws.extendedCopy, self.priorX)
+            np.add(ws.extendedCenter, ws.scaledSqrtQ, out=ws.extendedPlus)
+            np.subtract(ws.extendedCenter, ws.scaledSqrtQ, out=ws.extendedMinus)
+
+        if ws.observationOut and self.inputAtOutput:
+            self.observationFunction(ws.sigmaX, self.uk0, out=ws.sigmaY)
+        elif ws.observationOut:
+            self.observationFunction(ws.sigmaX, out=ws.sigmaY)
+        else:
+            self.evaluateObservation(ws.sigmaX, ws.sigmaY)
 
         # Update equations
-        self.pyy = np.copy(self.observationNoise)
-        self.pxy = np.zeros((self.stateDimension, self.outputDimension))
+        np.matmul(ws.sigmaY, ws.sigmaWeightsT, out=ws.y_prior)
+        np.subtract(ws.sigmaY, ws.y_prior, out=ws.dY)
+        np.multiply(ws.dY, ws.sigmaWeights, out=ws.dYw)
+        np.matmul(ws.dYw, ws.dYT, out=ws.pyy)
+        np.add(ws.pyy, self.observationNoise, out=ws.pyy)
+        np.subtract(ws.sigmaX, ws.x1_prior, out=ws.dSigmaX)
+        np.matmul(ws.dSigmaX, ws.dYwT, out=ws.pxy)
+
+        # K^T = pyy^-1 pxy^T from the Cholesky factor of pyy
+        np.copyto(ws.syy, ws.pyy)
+        choleskyInPlace(ws.syy)
+        np.copyto(ws.kalmanGainT, ws.pxyT)
+        lapack.dpotrs(ws.syy, ws.kalmanGainT, lower=1, overwrite_b=1)
+
+        # x = x- + K (y - y-) and P = P- - K pyy K^T = P- - pxy K^T
+        np.subtract(yk1, ws.y_prior, out=ws.innovation)
+        np.matmul(ws.kalmanGain, ws.innovation, out=ws.correction)
+        np.add(ws.x1_prior, ws.correction, out=ws.x0)
+        np.matmul(ws.pxy, ws.kalmanGainT, out=ws.covarianceCorrection)
+        np.subtract(ws.p1_prior, ws.covarianceCorrection, out=ws.p0)
+
+        # Expose the buffers through the usual attributes
+        self.x1_prior, self.p1_prior, self.y_prior = ws.x1_prior, ws.p1_prior, ws.y_prior
+        self.pyy, self.pxy, self.kalmanGain = ws.pyy, ws.pxy, ws.kalmanGain
+        self.x0, self.p0 = ws.x0, ws.p0
+
+        return self.x0, self.p0
+
+    def run(self, U, Y, decimation=1, store_covariance=True, store_gain=True):
+        # Filters a whole recording. Row k of U (inputs) and Y (measurements) feed one aPosterioriEstimation call,
+        # the filter state is updated internally. Every decimation-th step is written into preallocated arrays. The
+        # run stops early if the estimate stops being finite or pyy becomes singular
+        U = np.reshape(U, (np.size(U, 0), -1))
+        Y = np.reshape(Y, (np.size(Y, 0), -1))
+        steps = np.size(Y, 0)
+        trajectory = FilterTrajectory(steps, self.stateDimension, self.outputDimension, decimation=decimation,
+                                      store_covariance=store_covariance, store_gain=store_gain)
+
+        for k in range(0, steps):
+            yk1 = Y[k, :, np.newaxis]
+            try:
+                xk1, Pk1 = self.aPosterioriEstimation(U[k, :, np.newaxis], yk1, internal=True)
+            except np.linalg.LinAlgError:
+                break
+
+            if not (np.all(np.isfinite(xk1)) and np.all(np.isfinite(Pk1))):
+                break
+
+            if k % decimation == 0:
+                trajectory.store(k // decimation, xk1, Pk1, yk1 - self.y_prior, self.kalmanGain)
+            trajectory.steps = k + 1
+
+        return trajectory
+
+
+class FilterTrajectory:
+    def __init__(self, steps, state_dimension, output_dimension, decimation=1, store_covariance=True,
+                 store_gain=True):
+        # Preallocated output of UnscentedKalmanFilter.run. Row i holds step k[i]; rows that were not reached are NaN
+        self.decimation = decimation
+        self.steps = 0
+        self.k = np.arange(0, steps, decimation)
+        size = np.size(self.k)
+
+        self.x = np.full((size, state_dimension), np.nan)
+        self.innovation = np.full((size, output_dimension), np.nan)
+        if store_covariance:
+            self.p = np.full((size, state_dimension, state_dimension), np.nan)
+        else:
+            self.p = None
+        if store_gain:
+            self.gain = np.full((size, state_dimension, output_dimension), np.nan)
+        else:
+            self.gain = None
+
+    @property
+    def stored(self):
+        # Number of rows holding filtered steps
+        return (self.steps + self.decimation - 1) // self.decimation
+
+    def store(self, i, x, p, innovation, gain):
+        self.x[i, :] = x[:, 0]
+        self.innovation[i, :] = innovation[:, 0]
+        if self.p is not None:
+            self.p[i, :, :] = p
+        if self.gain is not None:
+            self.gain[i, :, :] = gain
+
+
+class StepWorkspace:
+    def __init__(self, ukf):
+        # Buffers and fixed views used by UnscentedKalmanFilter.step
+        n = ukf.stateDimension
+        ny = ukf.outputDimension
+
+        if ukf.recycleSigmaPoints:
+            self.sigmaX = ukf.priorX_extended
+            self.sigmaY = ukf.priorY_extended
+            self.sigmaWeights = ukf.weights_extended
+        else:
+            self.sigmaX = ukf.priorX
+            self.sigmaY = ukf.priorY
+            self.sigmaWeights = ukf.weights
+        m = np.size(self.sigmaX, 1)
+
+        # Models writing into the sigma-point matrices directly
+        self.processOut = ukf.vectorized and acceptsOut(ukf.processFunction)
+        self.observationOut = ukf.vectorized and acceptsOut(ukf.observationFunction)
+
+        # State, covariance and their factors. LAPACK factorizes in place Fortran-ordered arrays
+        self.x0 = np.array(ukf.x0, dtype=float).reshape(n, 1)
+        self.p0 = np.array(ukf.p0, dtype=float)
+        self.sP = np.zeros((n, n), order='F')
+        self.scaledSqrtP = np.zeros((n, n))
+        self.processNoise = None
+        self.scaledSqrtQ = np.zeros((n, n))
+
+        # Prior values and deviations from them
+        self.x1_prior = np.zeros((n, 1))
+        self.p1_prior = np.zeros((n, n))
+        self.y_prior = np.zeros((ny, 1))
+        self.dX = np.zeros((n, 2 * n + 1))
+        self.dXw = np.zeros((n, 2 * n + 1))
+        self.dSigmaX = np.zeros((n, m))
+        self.dY = np.zeros((ny, m))
+        self.dYw = np.zeros((ny, m))
+
+        # Update
+        self.pyy = np.zeros((ny, ny))
+        self.syy = np.zeros((ny, ny), order='F')
+        self.pxy = np.zeros((n, ny))
+        self.kalmanGainT = np.zeros((ny, n), order='F')
+        self.kalmanGain = self.kalmanGainT.T
+        self.innovation = np.zeros((ny, 1))
+        self.correction = np.zeros((n, 1))
+        self.covarianceCorrection = np.zeros((n, n))
+
+        # Views of the sigma-point matrices
+        self.XCenter = ukf.X[:, 0:1]
+        self.XPlus = ukf.X[:, 1:n + 1]
+        self.XMinus = ukf.X[:, n + 1:2 * n + 1]
+        self.extendedCopy = ukf.priorX_extended[:, 0:2 * n + 1]
+        self.extendedCenter = ukf.priorX[:, 0:1]
+        self.extendedPlus = ukf.priorX_extended[:, 2 * n + 1:3 * n + 1]
+        self.extendedMinus = ukf.priorX_extended[:, 3 * n + 1:4 * n + 1]
+
+        # Transposed views
+        self.weightsT = ukf.weights.T
+        self.sigmaWeightsT = self.sigmaWeights.T
+        self.dXT = self.dX.T
+        self.dYT = self.dY.T
+        self.dYwT = self.dYw.T
+        self.pxyT = self.pxy.T
+
+    def updateProcessNoise(self, process_noise, sqrt_gamma):
+        # Only runs when a new process noise matrix is assigned to the filter
+        self.processNoise = process_noise
+        np.multiply(np.linalg.cholesky(process_noise), sqrt_gamma, out=self.scaledSqrtQ)
+
+
+class SquareRootUnscentedKalmanFilter(UnscentedKalmanFilter):
+    def __init__(self, f, x0, p0, h=None, process_noise=None, observation_noise=None, uk0=None,
+                 recycle_sigma_points=True, kappa=1.0, input_at_output=False, vectorized=False):
+        # Same interface as UnscentedKalmanFilter. The lower Cholesky factor of the covariance (s0, p0 = s0 s0^T) is
+        # propagated through QR decompositions and rank-1 updates, so P is never square-rooted nor inverted
+        super().__init__(f, x0, p0, h=h, process_noise=process_noise, observation_noise=observation_noise, uk0=uk0,
+                         recycle_sigma_points=recycle_sigma_points, kappa=kappa, input_at_output=input_at_output,
+                         vectorized=vectorized)
+
+        # Cholesky factors
+        self.s0 = np.linalg.cholesky(self.p0)
+        self.s1_prior = np.copy(self.s0)
+        self.syy = np.zeros_like(self.observationNoise)
+        self.sqrtProcessNoise = np.linalg.cholesky(self.processNoise)
+        self.sqrtObservationNoise = np.linalg.cholesky(self.observationNoise)
+
+    def unscentedTransform(self, x, s, x_matrix):
+        # s is the Cholesky factor of the covariance, not the covariance itself
+        x_matrix[:, 0] = x[:, 0]
+        x_matrix[:, 1:self.stateDimension + 1] = x + self.sqrtGamma * s
+        x_matrix[:, self.stateDimension + 1:] = x - self.sqrtGamma * s
+        return x_matrix
+
+    def unscentedTransformExtended(self, x_matrix_old, x_matrix_new, s):
+        n = self.stateDimension
+        x_matrix_new[:, 0:2 * n + 1] = x_matrix_old
+        x_matrix_new[:, 2 * n + 1:3 * n + 1] = x_matrix_old[:, [0]] + self.sqrtGamma_extended * s
+        x_matrix_new[:, 3 * n + 1:] = x_matrix_old[:, [0]] - self.sqrtGamma_extended * s
+        return x_matrix_new
+
+    def aPosterioriEstimation(self, uk0, yk1, internal=False, process_noise=None, observation_noise=None):
+        # Update process and observation noises
+        if process_noise is not None:
+            self.processNoise = process_noise
+            self.sqrtProcessNoise = np.linalg.cholesky(process_noise)
+
+        if observation_noise is not None:
+            self.observationNoise = observation_noise
+            self.sqrtObservationNoise = np.linalg.cholesky(observation_noise)
 
+        # Update input
+        self.uk0 = uk0
+
+        # Obtain sigma points from previous a posteriori estimation
+        self.unscentedTransform(self.x0, self.s0, self.X)
+
+        # Evaluate sigma points
+        self.evaluateProcess(self.X, self.priorX)
+
+        # Obtain prior values
+        self.x1_prior = weightedMean(self.priorX, self.weights)
+        self.s1_prior = sqrtWeightedCovariance(self.priorX, self.x1_prior, self.weights, self.sqrtProcessNoise)
+        self.p1_prior = np.matmul(self.s1_prior, self.s1_prior.T)
+
+        # Propagate prediction
         if self.recycleSigmaPoints:
-            for i in range(0, np.size(self.priorY_extended, 1)):
-                v = np.vstack(self.priorY_extended[:, i]) - self.y_prior
-                self.pyy += self.weights_extended[0, i] * np.outer(v, v)
+            self.unscentedTransformExtended(self.priorX, self.priorX_extended, self.sqrtProcessNoise)
+            sigmaX = self.priorX_extended
+            sigmaY = self.evaluateObservation(self.priorX_extended, self.priorY_extended)
+            weights = self.weights_extended
+        else:
+            sigmaX = self.priorX
+            sigmaY = self.evaluateObservation(self.priorX, self.priorY)
+            weights = self.weights
+
+        # Update equations
+        self.y_prior = weightedMean(sigmaY, weights)
+        self.syy = sqrtWeightedCovariance(sigmaY, self.y_prior, weights, self.sqrtObservationNoise)
+        self.pyy = np.matmul(self.syy, self.syy.T)
+        self.pxy = weightedCovariance(sigmaX, self.x1_prior, weights, sigmaY, self.y_prior)
 
-                w = np.vstack(self.priorX_extended[:, i]) - self.x1_prior
-                ww = np.vstack(self.priorY_extended[:, i]) - self.y_prior
-                self.pxy = self.weights_extended[0, i] * np.outer(w, ww)
+        # K = pxy syy^-T syy^-1 solved from the factor, without forming the inverse of pyy
+        self.kalmanGain = lapack.dpotrs(self.syy, self.pxy.T, lower=1)[0].T
+        xk1 = self.x1_prior + np.matmul(self.kalmanGain, yk1 - self.y_prior)
+
+        # P = P- - (K syy)(K syy)^T as one rank-1 downdate per output
+        Sk1 = np.copy(self.s1_prior)
+        U = np.matmul(self.kalmanGain, self.syy)
+        for i in range(0, np.size(U, 1)):
+            cholupdate(Sk1, U[:, i], -1.0)
+        Pk1 = np.matmul(Sk1, Sk1.T)
+
+        if internal:
+            self.x0 = xk1
+            self.p0 = Pk1
+            self.s0 = Sk1
+
+        return xk1, Pk1
+
+    def step(self, uk0, yk1):
+        # The square-root update has no in-place path, so this is the regular internal estimation
+        return self.aPosterioriEstimation(uk0, yk1, internal=True)
+
+
+class UnscentedKalmanFilterBank:
+    def __init__(self, f, x0, p0, h=None, process_noise=None, observation_noise=None, uk0=None,
+                 recycle_sigma_points=True, kappa=1.0, input_at_output=False):
+        # N filters sharing f, h and kappa, advanced together. States are stacked as x0 (N, n, 1) and covariances as
+        # p0 (N, n, n); noises may be a single (n, n) matrix or one per filter. f(X, u) and h(X) (or h(X, u)) receive
+        # the stacked sigma points X (N, n, m) and inputs u (N, nu, 1) and return (N, n, m) and (N, ny, m) arrays
+        self.processFunction = f
+        self.x0 = np.asarray(x0, dtype=float)
+        self.numberOfFilters, self.stateDimension = np.shape(self.x0)[0:2]
+        self.p0 = np.broadcast_to(p0, (self.numberOfFilters, self.stateDimension, self.stateDimension)).copy()
+
+        if h is None:
+            self.observationFunction = lambda x: x
 
         else:
-            for i in range(0, np.size(self.priorY, 1)):
-                v = np.vstack(self.priorY[:, i]) - self.y_prior
-                self.pyy += self.weights[0, i] * np.outer(v, v)
+            self.observationFunction = h
 
-                w = np.vstack(self.priorX[:, i]) - self.x1_prior
-                ww = np.vstack(self.priorY[:, i]) - self.y_prior
-                self.pxy = self.weights[0, i] * np.outer(w, ww)
+        self.recycleSigmaPoints = recycle_sigma_points
+        self.inputAtOutput = input_at_output
 
-        self.kalmanGain = np.matmul(self.pxy, np.linalg.inv(self.pyy))
+        # Initial input
+        if uk0 is None:
+            self.uk0 = np.zeros((self.numberOfFilters, 1, 1))
+        else:
+            self.uk0 = np.asarray(uk0, dtype=float)
+
+        # Calculated from inputs
+        if input_at_output:
+            self.outputDimension = np.shape(self.observationFunction(self.x0, self.uk0))[1]
+        else:
+            self.outputDimension = np.shape(self.observationFunction(self.x0))[1]
+
+        # Covariance matrices
+        if process_noise is None:
+            self.processNoise = np.eye(self.stateDimension)
+        else:
+            self.processNoise = process_noise
+
+        if observation_noise is None:
+            self.observationNoise = np.eye(self.outputDimension)
+        else:
+            self.observationNoise = observation_noise
+
+        # Create sigma points matrices
+        N, n = self.numberOfFilters, self.stateDimension
+        self.X = np.zeros([N, n, 2 * n + 1])
+        self.priorX = np.zeros([N, n, 2 * n + 1])
+        self.priorX_extended = np.zeros([N, n, 4 * n + 1])
+        self.priorY = np.zeros([N, self.outputDimension, 2 * n + 1])
+        self.priorY_extended = np.zeros([N, self.outputDimension, 4 * n + 1])
+
+        # Sigma points weights
+        self.weights = np.zeros([1, 2 * n + 1])
+        self.weights_extended = np.zeros([1, 4 * n + 1])
+        self.updateWeights(kappa)
+
+        # prior vectors
+        self.x1_prior = np.copy(self.x0)
+        self.p1_prior = np.copy(self.p0)
+        self.y_prior = np.zeros([N, self.outputDimension, 1])
+
+        # Matrices
+        self.pyy = np.zeros([N, self.outputDimension, self.outputDimension])
+        self.pxy = np.zeros([N, n, self.outputDimension])
+        self.kalmanGain = np.zeros([N, n, self.outputDimension])
+
+    def updateWeights(self, kappa):
+        # Same weights as UnscentedKalmanFilter, shared by every filter of the bank
+        self.kappa = kappa
+        self.gamma = self.stateDimension + kappa
+        self.sqrtGamma = np.sqrt(self.gamma)
+        self.weights[0, :] = 1 / (2.0 * self.gamma)
+        self.weights[0, 0] = kappa / self.gamma
+
+        self.gamma_extended = 2 * self.stateDimension + kappa
+        self.sqrtGamma_extended = np.sqrt(self.gamma_extended)
+        self.weights_extended[0, :] = 1 / (2.0 * self.gamma_extended)
+        self.weights_extended[0, 0] = kappa / self.gamma_extended
+
+    def unscentedTransform(self, x, p, x_matrix):
+        sP = batchedSqrtm(p)
+        n = self.stateDimension
+        x_matrix[:, :, 0] = x[:, :, 0]
+        x_matrix[:, :, 1:n + 1] = x + self.sqrtGamma * sP
+        x_matrix[:, :, n + 1:] = x - self.sqrtGamma * sP
+        return x_matrix
+
+    def unscentedTransformExtended(self, x_matrix_old, x_matrix_new, p):
+        sP = batchedSqrtm(p)
+        n = self.stateDimension
+        x_matrix_new[:, :, 0:2 * n + 1] = x_matrix_old
+        x_matrix_new[:, :, 2 * n + 1:3 * n + 1] = x_matrix_old[:, :, [0]] + self.sqrtGamma_extended * sP
+        x_matrix_new[:, :, 3 * n + 1:] = x_matrix_old[:, :, [0]] - self.sqrtGamma_extended * sP
+        return x_matrix_new
+
+    def evaluateObservation(self, x_matrix, out):
+        if self.inputAtOutput:
+            out[...] = self.observationFunction(x_matrix, self.uk0)
+        else:
+            out[...] = self.observationFunction(x_matrix)
+        return out
+
+    def aPosterioriEstimation(self, uk0, yk1, internal=False, process_noise=None, observation_noise=None):
+        # uk0 (N, nu, 1) and yk1 (N, ny, 1) hold one input and one measurement per filter. Returns the stacked
+        # a posteriori states (N, n, 1) and covariances (N, n, n)
+        # Update process and observation noises
+        if process_noise is not None:
+            self.processNoise = process_noise
+
+        if observation_noise is not None:
+            self.observationNoise = observation_noise
+
+        # Update input
+        self.uk0 = uk0
+
+        # Obtain sigma points from previous a posteriori estimation
+        self.unscentedTransform(self.x0, self.p0, self.X)
+
+        # Evaluate sigma points
+        self.priorX[...] = self.processFunction(self.X, self.uk0)
+
+        # Obtain prior values
+        self.x1_prior = weightedMean(self.priorX, self.weights)
+        self.p1_prior = self.processNoise + weightedCovariance(self.priorX, self.x1_prior, self.weights)
+
+        # Propagate prediction
+        if self.recycleSigmaPoints:
+            self.unscentedTransformExtended(self.priorX, self.priorX_extended, self.processNoise)
+            sigmaX = self.priorX_extended
+            sigmaY = self.evaluateObservation(self.priorX_extended, self.priorY_extended)
+            weights = self.weights_extended
+        else:
+            sigmaX = self.priorX
+            sigmaY = self.evaluateObservation(self.priorX, self.priorY)
+            weights = self.weights
+
+        # Update equations
+        self.y_prior = weightedMean(sigmaY, weights)
+        self.pyy = self.observationNoise + weightedCovariance(sigmaY, self.y_prior, weights)
+        self.pxy = weightedCovariance(sigmaX, self.x1_prior, weights, sigmaY, self.y_prior)
+
+        # K = pxy pyy^-1 for every filter at once (pyy is symmetric)
+        self.kalmanGain = np.swapaxes(np.linalg.solve(self.pyy, np.swapaxes(self.pxy, -1, -2)), -1, -2)
         xk1 = self.x1_prior + np.matmul(self.kalmanGain, yk1 - self.y_prior)
-        Pk1 = self.p1_prior - np.matmul(np.matmul(self.kalmanGain, self.pyy), self.kalmanGain.T)
+        Pk1 = self.p1_prior - np.matmul(np.matmul(self.kalmanGain, self.pyy), np.swapaxes(self.kalmanGain, -1, -2))
 
         if internal:
             self.x0 = xk1
@@ -216,3 +699,80 @@ class UnscentedKalmanFilter:
 
 def weightedSum(X, W):
     return np.vstack(np.average(X, axis=1, weights=W[0, :]))
+
+
+def weightedMean(X, W):
+    # Weighted mean of the columns of X as a matrix-vector product. X may be a stack of matrices (..., n, m)
+    return np.matmul(X, W.T)
+
+
+def weightedCovariance(X, x, W, Y=None, y=None):
+    # Weighted (cross-)covariance of the columns of X and Y around x and y: (X - x) diag(W) (Y - y)^T
+    dX = X - x
+    if Y is None:
+        dY = dX
+    else:
+        dY = Y - y
+    return np.matmul(dX * W, np.swapaxes(dY, -1, -2))
+
+
+def batchedSqrtm(P):
+    # Principal square root of a stack of symmetric matrices (..., n, n) through one batched eigendecomposition. It
+    # equals sqrtm for PSD matrices; negative eigenvalues from round-off are clipped instead of turning complex
+    w, V = np.linalg.eigh(P)
+    return np.matmul(V * np.sqrt(np.maximum(w, 0.0))[..., np.newaxis, :], np.swapaxes(V, -1, -2))
+
+
+def sqrtWeightedCovariance(X, x, W, sqrt_noise):
+    # Lower Cholesky factor of (X - x) diag(W) (X - x)^T + sqrt_noise sqrt_noise^T from a QR decomposition. Only the
+    # zeroth weight can be negative (kappa < 0), in which case its column is removed with a rank-1 downdate
+    dX = X - x
+    if W[0, 0] >= 0:
+        return triangularFactor(np.hstack([dX * np.sqrt(W), sqrt_noise]))
+
+    S = triangularFactor(np.hstack([dX[:, 1:] * np.sqrt(W[:, 1:]), sqrt_noise]))
+    return cholupdate(S, dX[:, 0] * np.sqrt(-W[0, 0]), -1.0)
+
+
+def triangularFactor(A):
+    # Lower triangular S such that S S^T = A A^T, from the R factor of A^T with a positive diagonal
+    n = np.size(A, 0)
+    S = lapack.dgeqrf(A.T)[0][0:n, :].T * lowerTriangularMask(n)
+    S *= np.copysign(1.0, S.diagonal())
+    return S
+
+
+def choleskyInPlace(A):
+    # Overwrites the Fortran-ordered matrix A with its lower Cholesky factor
+    info = lapack.dpotrf(A, lower=1, clean=1, overwrite_a=1)[1]
+    if info != 0:
+        raise np.linalg.LinAlgError("Matrix is not positive definite")
+    return A
+
+
+def acceptsOut(function):
+    # True if the model function can write its result into an out argument
+    try:
+        return 'out' in signature(function).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+@lru_cache(maxsize=None)
+def lowerTriangularMask(n):
+    return np.tri(n)
+
+
+def cholupdate(L, v, sign=1.0):
+    # In-place rank-1 update (sign=1) or downdate (sign=-1) of the lower Cholesky factor L: L L^T + sign v v^T
+    v = np.array(v, dtype=float)
+    n = np.size(v)
+    for k in range(0, n):
+        r = np.sqrt(L[k, k] ** 2 + sign * v[k] ** 2)
+        c = r / L[k, k]
+        s = v[k] / L[k, k]
+        L[k, k] = r
+        if k + 1 < n:
+            L[k + 1:, k] = (L[k + 1:, k] + sign * s * v[k + 1:]) / c
+            v[k + 1:] = c * v[k + 1:] - s * L[k + 1:, k]
+    return L
@@ -0,0 +1,98 @@
+"""
+Acquisition throughput benchmark against the simulated N3300A.
+
+Every case reads full pack snapshots (voltage and the current of three channels) as fast as possible and reports
+samples per second and CPU seconds per sample. The cases sweep the response latency of the simulator and how a
+snapshot is read:
+    requests        one request per value with set_channel in between, as the experiment tools used to do
+    transaction     ElectronicLoad.read_snapshot, one round trip
+    async           AsyncElectronicLoad.read_snapshot through the non-blocking transport
+
+Run from the repository root on Linux; results are written as JSON so runs can be compared:
+    python -m test.benchmark_acquisition --output bench_acquisition.json
+"""
+from res.SerialCom import SerialConfig, LoadConfig, ElectronicLoad
+from res.acquisition import AsyncElectronicLoad
+from res.simulator import N3300ASimulator
+import argparse
+import asyncio
+import json
+import platform
+import tempfile
+import time
+
+
+def read_requests(electronic_load):
+    volt = float(electronic_load.read_voltage_raw())
+    currents = []
+    for channel in (1, 2, 3):
+        electronic_load.set_channel(channel)
+        currents.append(float(electronic_load.read_current_raw()))
+    return volt, currents
+
+
+def run_case(electronic_load, mode, samples):
+    if mode == 'async':
+        async def read_all():
+            load = AsyncElectronicLoad(electronic_load)
+            load.open()
+            try:
+                for _ in range(samples):
+                    await load.read_snapshot()
+            finally:
+                load.close()
+
+        read = lambda: asyncio.run(read_all())
+    else:
+        snapshot = read_requests if mode == 'requests' else ElectronicLoad.read_snapshot
+        read = lambda: [snapshot(electronic_load) for _ in range(samples)]
+
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    read()
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    return {'samples_per_second': samples / wall,
+            'milliseconds_per_sample': 1e3 * wall / samples,
+            'cpu_seconds_per_sample': cpu / samples}
+
+
+def run_benchmark(samples=200, latencies=(0.0, 0.001, 0.005)):
+    """
+    Runs every case.
+    :param samples: snapshots read per case.
+    :param latencies:   response latencies of the simulator in seconds.
+    :return:    dictionary with the environment and one result per case.
+    """
+    results = []
+    folder = tempfile.mkdtemp()
+    for latency in latencies:
+        with N3300ASimulator(latency=latency) as simulator:
+            electronic_load = ElectronicLoad(SerialConfig(port=simulator.port), LoadConfig(channels=(1, 2, 3)),
+                                             measurement_folder_path=folder + '/')
+            electronic_load.set_current(27)
+            for mode in ('requests', 'transaction', 'async'):
+                result = {'latency': latency, 'mode': mode}
+                result.update(run_case(electronic_load, mode, samples))
+                results.append(result)
+                print("latency=%-6.3f %-12s %10.1f samples/s %8.3f ms/sample %10.6f cpu s/sample" %
+                      (latency, mode, result['samples_per_second'], result['milliseconds_per_sample'],
+                       result['cpu_seconds_per_sample']))
+            electronic_load.serial.close()
+
+    return {'python': platform.python_version(), 'machine': platform.machine(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'samples': samples, 'results': results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Acquisition throughput benchmark against the simulated N3300A')
+    parser.add_argument('--output', default='bench_acquisition.json', help='JSON file where results are written')
+    parser.add_argument('--samples', type=int, default=200, help='snapshots read per case')
+    parser.add_argument('--latencies', type=float, nargs='+', default=[0.0, 0.001, 0.005],
+                        help='response latencies of the simulator in seconds')
+    args = parser.parse_args()
+
+    report = run_benchmark(samples=args.samples, latencies=args.latencies)
+    with open(args.output, 'w') as file_handle:
+        json.dump(report, file_handle, indent=2)
+    print('Results written to', args.output)
@@ -0,0 +1,198 @@
+"""
+Throughput and memory benchmark of the UnscentedKalmanFilter hot path.
+
+Every case filters a synthetic record and reports steps per second and the peak memory traced during the steps. The
+cases sweep the model (linear, polar and Pola examples), the state dimension, recycle_sigma_points, input_at_output
+and how sigma points are evaluated:
+    loop        per-column models, aPosterioriEstimation
+    vectorized  batched models, aPosterioriEstimation with vectorized=True
+    step        batched models, allocation-free step()
+
+Run from the repository root; results are written as JSON so runs can be compared:
+    python -m test.benchmark_ukf --output bench_ukf.json
+"""
+from res.ukf import UnscentedKalmanFilter
+from models.polaModel import PolaModel
+import argparse
+import itertools
+import json
+import platform
+import time
+import tracemalloc
+import numpy as np
+
+
+# %% Example models. Per-column versions take and return (n, 1) vectors, batched versions one state per column
+def F_linearModel(x, u):
+    return x + u[0, 0]
+
+
+def H_distance(x):
+    return np.vstack([np.sqrt(np.sum(x[:, 0] ** 2))])
+
+
+def H_distanceWithInput(x, u):
+    return np.vstack([np.sqrt(np.sum(x[:, 0] ** 2)) - u[0, 0]])
+
+
+def H_cartesianToPolar(x):
+    return np.vstack([np.sqrt(x[0, 0] ** 2 + x[1, 0] ** 2), np.arctan2(x[1, 0], x[0, 0])])
+
+
+def H_cartesianToPolarWithInput(x, u):
+    return H_cartesianToPolar(x) - u[0, 0]
+
+
+def Fb_linearModel(x, u, out=None):
+    return np.add(x, u[0, 0], out=out)
+
+
+def Hb_distance(x):
+    return np.sqrt(np.sum(x ** 2, axis=0, keepdims=True))
+
+
+def Hb_distanceWithInput(x, u):
+    return Hb_distance(x) - u[0, 0]
+
+
+def Hb_cartesianToPolar(x):
+    return np.vstack([np.sqrt(x[0] ** 2 + x[1] ** 2), np.arctan2(x[1], x[0])])
+
+
+def Hb_cartesianToPolarWithInput(x, u):
+    return Hb_cartesianToPolar(x) - u[0, 0]
+
+
+def pola_scalar_models(model):
+    # Per-column wrappers of the Pola kernels
+    return (lambda x, u: model.process(x, u)), (lambda x, u: model.observation(x, u))
+
+
+# %% Cases
+def build_case(model_name, n, input_at_output, mode, steps, rng):
+    """
+    Creates the models, initial conditions and synthetic record of one case.
+    :return:    (f, h, x0, p0, Q, R, U, Y) or None if the combination does not exist.
+    """
+    batched = mode != 'loop'
+
+    if model_name == 'pola':
+        if n != 2 or not input_at_output:
+            return None
+        model = PolaModel()
+        if batched:
+            f, h = model.process, model.observation
+        else:
+            f, h = pola_scalar_models(model)
+        x0 = np.vstack([0.26, 0.85])
+        p0 = np.diag([2e-4 ** 2, 1e-3 ** 2])
+        Q = np.diag([5e-8, 1e-6])
+        R = np.array([[0.9]])
+        I = 20.0 + 5.0 * np.sin(np.arange(steps) / 30.0)
+        U = np.column_stack([np.full(steps, 40.0), I])
+        Y = 38.0 + rng.normal(0.0, 0.3, (steps, 1))
+        return f, h, x0, p0, Q, R, U, Y
+
+    if model_name == 'polar' and n != 2:
+        return None
+
+    f = Fb_linearModel if batched else F_linearModel
+    if model_name == 'linear':
+        if batched:
+            h = Hb_distanceWithInput if input_at_output else Hb_distance
+        else:
+            h = H_distanceWithInput if input_at_output else H_distance
+    else:
+        if batched:
+            h = Hb_cartesianToPolarWithInput if input_at_output else Hb_cartesianToPolar
+        else:
+            h = H_cartesianToPolarWithInput if input_at_output else H_cartesianToPolar
+
+    x0 = np.ones((n, 1))
+    p0 = 0.1 * np.eye(n)
+    Q = 1e-3 * np.eye(n)
+    U = np.full((steps, 1), 0.01)
+    ny = 2 if model_name == 'polar' else 1
+    R = 0.1 * np.eye(ny)
+    Y = np.ones((steps, ny)) + rng.normal(0.0, 0.1, (steps, ny))
+    return f, h, x0, p0, Q, R, U, Y
+
+
+def run_case(case, recycle_sigma_points, input_at_output, mode, steps):
+    f, h, x0, p0, Q, R, U, Y = case
+
+    def make_filter():
+        return UnscentedKalmanFilter(f, x0, p0, h=h, process_noise=Q, observation_noise=R, uk0=U[0, :, np.newaxis],
+                                     recycle_sigma_points=recycle_sigma_points, input_at_output=input_at_output,
+                                     vectorized=mode != 'loop')
+
+    def filter_record(ukf, number_of_steps):
+        for k in range(0, number_of_steps):
+            uk = U[k, :, np.newaxis]
+            yk = Y[k, :, np.newaxis]
+            if mode == 'step':
+                ukf.step(uk, yk)
+            else:
+                ukf.aPosterioriEstimation(uk, yk, internal=True)
+
+    # Throughput, after one warm-up step that allocates the step buffers
+    ukf = make_filter()
+    filter_record(ukf, 1)
+    t0 = time.perf_counter()
+    filter_record(ukf, steps)
+    elapsed = time.perf_counter() - t0
+
+    # Peak memory traced while stepping, in a separate run since tracing slows everything down
+    ukf = make_filter()
+    filter_record(ukf, 1)
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    filter_record(ukf, min(steps, 100))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'steps_per_second': steps / elapsed,
+            'microseconds_per_step': 1e6 * elapsed / steps,
+            'peak_memory_bytes': peak - baseline,
+            'retained_memory_bytes': current - baseline}
+
+
+def run_benchmark(steps=2000, dimensions=(2, 4, 8, 16), seed=0):
+    """
+    Runs every case.
+    :param steps:   filtered steps per case.
+    :param dimensions:  state dimensions of the linear model. The polar and Pola models are 2-D.
+    :param seed:    seed of the synthetic measurements.
+    :return:    dictionary with the environment and one result per case.
+    """
+    results = []
+    for model_name, n, recycle, input_at_output, mode in itertools.product(('linear', 'polar', 'pola'), dimensions,
+                                                                           (True, False), (False, True),
+                                                                           ('loop', 'vectorized', 'step')):
+        case = build_case(model_name, n, input_at_output, mode, steps, np.random.default_rng(seed))
+        if case is None:
+            continue
+        result = {'model': model_name, 'state_dimension': n, 'recycle_sigma_points': recycle,
+                  'input_at_output': input_at_output, 'mode': mode}
+        result.update(run_case(case, recycle, input_at_output, mode, steps))
+        results.append(result)
+        print("%-7s n=%-3d recycle=%-5s input_at_output=%-5s %-10s %10.0f steps/s %8d B peak" %
+              (model_name, n, recycle, input_at_output, mode, result['steps_per_second'],
+               result['peak_memory_bytes']))
+
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'steps': steps, 'results': results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='UnscentedKalmanFilter throughput benchmark')
+    parser.add_argument('--output', default='bench_ukf.json', help='JSON file where results are written')
+    parser.add_argument('--steps', type=int, default=2000, help='filtered steps per case')
+    parser.add_argument('--dimensions', type=int, nargs='+', default=[2, 4, 8, 16],
+                        help='state dimensions of the linear model')
+    args = parser.parse_args()
+
+    report = run_benchmark(steps=args.steps, dimensions=args.dimensions)
+    with open(args.output, 'w') as file_handle:
+        json.dump(report, file_handle, indent=2)
+    print('Results written to', args.output)
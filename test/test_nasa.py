@@ -0,0 +1,30 @@
+"""
+Checks of the vectorized step integrals of the NASA RW cache against a per-step trapezoid.
+    python -m pytest test
+"""
+from data.nasa import segment_trapezoid
+import numpy as np
+
+
+def step_trapezoid(y, x, offsets, step):
+    # Reference: trapezoid over the samples of one step only
+    ys = y[offsets[step]:offsets[step + 1]]
+    xs = x[offsets[step]:offsets[step + 1]]
+    return sum(0.5 * (ys[i + 1] + ys[i]) * (xs[i + 1] - xs[i]) for i in range(len(ys) - 1))
+
+
+def test_segment_trapezoid_matches_per_step_trapezoid():
+    # Steps of every length, including empty and single-sample ones, with jumps in x between steps
+    rng = np.random.default_rng(0)
+    lengths = np.array([5, 0, 1, 2, 40, 3, 0, 17, 1, 8])
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    x = np.cumsum(rng.uniform(0.1, 2.0, offsets[-1])) + np.repeat(1e3 * np.arange(len(lengths)), lengths)
+    y = rng.standard_normal(offsets[-1])
+
+    # Unordered and repeated selections
+    steps = np.array([4, 0, 2, 9, 1, 7, 4, 3, 6, 5, 8])
+    expected = [step_trapezoid(y, x, offsets, step) for step in steps]
+
+    # Integrals are differences of one cumulative sum, so rounding scales with the sum, not with each step
+    np.testing.assert_allclose(segment_trapezoid(y, x, offsets, steps), expected, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(segment_trapezoid(y, x, offsets, [1, 2, 8]), 0.0)
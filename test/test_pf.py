@@ -0,0 +1,59 @@
+"""
+Checks of the particle filter: systematic resampling counts and weighting of particles with non-finite outputs.
+    python -m pytest test
+"""
+from res.pf import ParticleFilter, systematicResample
+from models.polaModel import PolaModel
+import numpy as np
+import pytest
+
+# Noises of batteryModel_Pola.py
+P0 = np.array([[2e-4 ** 2, 0.0], [0.0, 1e-3 ** 2]])
+Q = np.array([[5e-8, 0.0], [0.0, 1e-6]])
+R = np.array([[0.9]])
+
+
+def pola_filter(x0, number_of_particles=10000, seed=0):
+    model = PolaModel()
+    return ParticleFilter(model.process, np.vstack(x0), P0, h=model.observation, process_noise=Q, observation_noise=R,
+                          uk0=np.vstack([model.vo, 0.0]), input_at_output=True,
+                          number_of_particles=number_of_particles, seed=seed)
+
+
+def test_systematic_resample_counts_known_weights():
+    # Every offset gives the same copies when N w is an integer
+    weights = np.array([0.5, 0.25, 0.25, 0.0])
+    for seed in range(20):
+        idx = systematicResample(weights, np.random.default_rng(seed))
+        np.testing.assert_array_equal(np.bincount(idx, minlength=4), [2, 1, 1, 0])
+
+
+def test_systematic_resample_counts_within_one_copy():
+    rng = np.random.default_rng(0)
+    weights = rng.uniform(size=1000)
+    weights /= np.sum(weights)
+    counts = np.bincount(systematicResample(weights, rng), minlength=1000)
+    assert np.sum(counts) == 1000
+    assert np.all(np.abs(counts - 1000 * weights) < 1.0)
+
+
+@pytest.mark.filterwarnings('ignore:invalid value encountered in sqrt')
+def test_particles_below_zero_soc_do_not_break_the_filter():
+    # Near empty, part of the particles have SOC < 0 and a nan voltage. They get zero weight instead of making every
+    # estimate nan
+    pf = pola_filter([0.26, 0.002])
+    assert np.any(pf.particles[1] < 0)
+    for _ in range(5):
+        x, p = pf.aPosterioriEstimation(np.vstack([33.0, 27.0]), np.vstack([32.0]))
+        assert np.all(np.isfinite(x)) and np.all(np.isfinite(p))
+        assert np.isfinite(pf.effectiveSampleSize)
+
+
+@pytest.mark.filterwarnings('ignore:invalid value encountered in sqrt')
+def test_no_finite_likelihood_raises_and_keeps_the_weights():
+    pf = pola_filter([0.26, 0.5], number_of_particles=100)
+    pf.particles[1] = -1.0
+    log_weights = pf.logWeights.copy()
+    with pytest.raises(np.linalg.LinAlgError):
+        pf.update(np.vstack([32.0]))
+    np.testing.assert_array_equal(pf.logWeights, log_weights)
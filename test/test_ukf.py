@@ -0,0 +1,110 @@
+"""
+Consistency checks of the UnscentedKalmanFilter variants against the regular filter.
+
+On a linear model the unscented transform is exact whatever matrix square root spreads the sigma points, so every
+variant must reproduce the estimates of UnscentedKalmanFilter.aPosterioriEstimation up to rounding. On nonlinear
+models step() spreads them along the Cholesky factor, as SquareRootUnscentedKalmanFilter does, and must match it.
+    python -m pytest test
+"""
+from res.ukf import UnscentedKalmanFilter, SquareRootUnscentedKalmanFilter, UnscentedKalmanFilterBank
+from models.polaModel import PolaModel
+import numpy as np
+import pytest
+
+A = np.array([[1.0, 0.1], [-0.05, 0.95]])
+B = np.array([[0.0], [0.1]])
+C = np.array([[1.0, 0.5]])
+Q = np.array([[1e-3, 2e-4], [2e-4, 5e-4]])
+R = np.array([[1e-2]])
+X0 = np.array([[1.0], [-0.5]])
+P0 = np.array([[0.2, 0.05], [0.05, 0.1]])
+
+
+def F_linear(x, u):
+    return np.matmul(A, x) + np.matmul(B, u)
+
+
+def H_linear(x):
+    return np.matmul(C, x)
+
+
+def linear_record(steps, seed=0):
+    rng = np.random.default_rng(seed)
+    U = rng.standard_normal((steps, 1, 1))
+    Y = rng.standard_normal((steps, 1, 1))
+    return U, Y
+
+
+@pytest.mark.parametrize('kappa', [1.0, 0.5, -1.0])
+@pytest.mark.parametrize('recycle_sigma_points', [True, False])
+def test_square_root_matches_regular_filter(kappa, recycle_sigma_points):
+    arguments = dict(h=H_linear, process_noise=Q, observation_noise=R, kappa=kappa,
+                     recycle_sigma_points=recycle_sigma_points)
+    ukf = UnscentedKalmanFilter(F_linear, X0.copy(), P0.copy(), **arguments)
+    srukf = SquareRootUnscentedKalmanFilter(F_linear, X0.copy(), P0.copy(), **arguments)
+
+    U, Y = linear_record(50)
+    for u, y in zip(U, Y):
+        x, p = ukf.aPosterioriEstimation(u, y, internal=True)
+        x_sr, p_sr = srukf.aPosterioriEstimation(u, y, internal=True)
+        np.testing.assert_allclose(x_sr, x, rtol=0, atol=1e-12)
+        np.testing.assert_allclose(p_sr, p, rtol=0, atol=1e-12)
+        np.testing.assert_allclose(np.matmul(srukf.s0, srukf.s0.T), p, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('recycle_sigma_points', [True, False])
+def test_bank_matches_single_filters(recycle_sigma_points):
+    # Every filter of the bank starts from its own state and covariance and sees its own record
+    N = 5
+    rng = np.random.default_rng(1)
+    x0 = X0 + 0.3 * rng.standard_normal((N, 2, 1))
+    p0 = P0 * rng.uniform(0.5, 2.0, (N, 1, 1))
+    U, Y = linear_record(30 * N, seed=2)
+    U = U.reshape(30, N, 1, 1)
+    Y = Y.reshape(30, N, 1, 1)
+
+    arguments = dict(process_noise=Q, observation_noise=R, recycle_sigma_points=recycle_sigma_points)
+    bank = UnscentedKalmanFilterBank(F_linear, x0.copy(), p0.copy(), h=H_linear, **arguments)
+    filters = [UnscentedKalmanFilter(F_linear, x0[i].copy(), p0[i].copy(), h=H_linear, **arguments) for i in range(N)]
+
+    for u, y in zip(U, Y):
+        x, p = bank.aPosterioriEstimation(u, y, internal=True)
+        for i, ukf in enumerate(filters):
+            x_i, p_i = ukf.aPosterioriEstimation(u[i], y[i], internal=True)
+            np.testing.assert_allclose(x[i], x_i, rtol=0, atol=1e-12)
+            np.testing.assert_allclose(p[i], p_i, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('recycle_sigma_points', [True, False])
+def test_step_matches_regular_filter_on_linear_model(recycle_sigma_points):
+    arguments = dict(h=H_linear, process_noise=Q, observation_noise=R, recycle_sigma_points=recycle_sigma_points)
+    ukf = UnscentedKalmanFilter(F_linear, X0.copy(), P0.copy(), **arguments)
+    stepped = UnscentedKalmanFilter(F_linear, X0.copy(), P0.copy(), vectorized=True, **arguments)
+
+    U, Y = linear_record(50, seed=3)
+    for u, y in zip(U, Y):
+        x, p = ukf.aPosterioriEstimation(u, y, internal=True)
+        x_step, p_step = stepped.step(u, y)
+        np.testing.assert_allclose(x_step, x, rtol=0, atol=1e-12)
+        np.testing.assert_allclose(p_step, p, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('recycle_sigma_points', [True, False])
+def test_step_matches_square_root_filter_on_pola_model(recycle_sigma_points):
+    model = PolaModel()
+    x0 = np.array([[0.26], [0.85]])
+    p0 = np.array([[2e-4 ** 2, 0.0], [0.0, 1e-3 ** 2]])
+    arguments = dict(h=model.observation, process_noise=np.diag([5e-8, 1e-6]), observation_noise=np.array([[0.9]]),
+                     uk0=np.vstack([model.vo, 0.0]), input_at_output=True, vectorized=True,
+                     recycle_sigma_points=recycle_sigma_points)
+    srukf = SquareRootUnscentedKalmanFilter(model.process, x0.copy(), p0.copy(), **arguments)
+    stepped = UnscentedKalmanFilter(model.process, x0.copy(), p0.copy(), **arguments)
+
+    rng = np.random.default_rng(4)
+    for k in range(200):
+        u = np.array([[38.0 + rng.standard_normal()], [27.0 + rng.standard_normal()]])
+        y = np.array([[37.5 + rng.standard_normal()]])
+        x, p = srukf.aPosterioriEstimation(u, y, internal=True)
+        x_step, p_step = stepped.step(u, y)
+        np.testing.assert_allclose(x_step, x, rtol=1e-12, atol=1e-15)
+        np.testing.assert_allclose(p_step, p, rtol=1e-9, atol=1e-15)
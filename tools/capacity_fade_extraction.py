@@ -0,0 +1,58 @@
+from data import nasa
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import os
+import time
+import numpy as np
+import pandas as pd
+
+
+def cell_capacity_fade(mat_path):
+    """
+    Capacity of every reference discharge of one cell. Module level so that it can be sent to pool workers; the
+    columnar cache is created by the worker the first time.
+    :param mat_path:    path to the RW .mat file of the cell.
+    :return:    data frame with columns cell, cycle, step, date and capacity (Ah).
+    """
+    dataset = nasa.load(mat_path)
+    steps, capacity = nasa.reference_capacity(dataset)
+    return pd.DataFrame({'cell': os.path.splitext(os.path.basename(mat_path))[0],
+                         'cycle': np.arange(np.size(steps)),
+                         'step': steps,
+                         'date': np.asarray(dataset.date)[steps] if dataset.date is not None else '',
+                         'capacity': capacity})
+
+
+def fleet_capacity_fade(mat_paths, number_of_workers=None):
+    """
+    Capacity fade of every cell, one worker process per cell at a time.
+    :param mat_paths:   RW .mat files.
+    :param number_of_workers:   size of the process pool. By default, cpu count.
+    :return:    one data frame with the reference discharges of all the cells.
+    """
+    with ProcessPoolExecutor(max_workers=number_of_workers) as pool:
+        tables = list(pool.map(cell_capacity_fade, mat_paths))
+    return pd.concat(tables, ignore_index=True)
+
+
+"""
+MODIFY FROM HERE
+"""
+dataset_folder = '../data/NASA_datasets/Battery_Uniform_Distribution_Charge_Discharge_DataSet_2Post/data/Matlab/'
+output_file = '../data/capacity_fade.csv'
+number_of_workers = None
+"""
+MODIFY BEFORE HERE
+"""
+
+if __name__ == "__main__":
+    cells = sorted(glob.glob(os.path.join(dataset_folder, 'RW*.mat')))
+    print('Cells found:', len(cells))
+
+    t0 = time.time()
+    table = fleet_capacity_fade(cells, number_of_workers=number_of_workers)
+    print('Capacity fade extracted in %.1f s' % (time.time() - t0))
+
+    table.to_csv(output_file, index=False)
+    print(table.groupby('cell').capacity.describe())
+    print('Table saved to', output_file)
@@ -0,0 +1,109 @@
+from models.polaModel import PolaModel
+from data import ground_truth
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import least_squares
+import numpy as np
+import time
+
+
+# Parameters fitted by least squares: theta = [alpha, beta, gamma, vo, vl, R]
+parameter_names = ('alpha', 'beta', 'gamma', 'vo', 'vl', 'R')
+theta_default = np.array([0.0053193, 11.505, 1.5538, 41.405, 33.481, 0.26])
+theta_lower = np.array([0.0, 0.1, 0.1, 0.0, 0.0, 0.0])
+theta_upper = np.array([0.5, 50.0, 20.0, 100.0, 100.0, 2.0])
+
+
+def voltage_residuals(theta, V, I, SOC):
+    # Terminal voltage of the Pola model along the whole record minus the measured one
+    model = PolaModel(alpha=theta[0], beta=theta[1], gamma=theta[2], vo=theta[3], vl=theta[4])
+    x = np.vstack([np.full(np.size(SOC), theta[5]), SOC])
+    u = np.vstack([V, I])
+    return model.observation(x, u)[0, :] - V
+
+
+def fit_candidate(name, theta0, decimation=1):
+    # One least squares run from theta0 on a ground truth set. Module level so that it can be sent to pool workers,
+    # which memory-map the set instead of receiving a copy of it. A failed run returns theta None and an infinite
+    # RMSE, so it does not discard the other candidates
+    data = ground_truth.open_dataset(name)
+    V = data.V[::decimation]
+    I = data.I[::decimation]
+
+    # The ground truth SOC = 1 - E / E[-1] dips slightly below zero when a record ends with non-positive power, where
+    # the Pola voltage (through sqrt(SOC)) is not defined
+    SOC = np.clip(data.SOC[::decimation], 0.0, 1.0)
+    try:
+        result = least_squares(voltage_residuals, theta0, args=(V, I, SOC), bounds=(theta_lower, theta_upper),
+                               x_scale='jac')
+    except (ValueError, np.linalg.LinAlgError):
+        return name, None, np.inf
+    rmse = np.sqrt(np.mean(result.fun ** 2))
+    return name, result.x, rmse
+
+
+def starting_points(number_of_starts, rng):
+    # The default parameters plus random candidates spread by factors in [0.5, 2] around them
+    factors = np.exp(rng.uniform(np.log(0.5), np.log(2.0), (number_of_starts - 1, np.size(theta_default))))
+    candidates = np.vstack([theta_default, theta_default * factors])
+    return np.clip(candidates, theta_lower, theta_upper)
+
+
+def identify(dataset_names, number_of_starts=16, number_of_workers=None, decimation=1, seed=0):
+    """
+    Fits the Pola parameters of every dataset with multi-start least squares. All (dataset, starting point)
+    candidates are evaluated in parallel in a process pool.
+    :param dataset_names:   names of the ground truth sets.
+    :param number_of_starts:    least squares runs per dataset.
+    :param number_of_workers:   size of the process pool. By default, cpu count.
+    :param decimation:  keeps one every decimation samples in the fit.
+    :param seed:    seed of the random starting points.
+    :return:    dictionary name -> (best theta, RMSE in V, Ecrit in J). Datasets where every run failed are left out.
+    """
+    # Opened here first, so the caches are built once before the workers map them
+    datasets = {name: ground_truth.open_dataset(name) for name in dataset_names}
+
+    rng = np.random.default_rng(seed)
+    tasks = []
+    for name in dataset_names:
+        for theta0 in starting_points(number_of_starts, rng):
+            tasks.append((name, theta0, decimation))
+
+    with ProcessPoolExecutor(max_workers=number_of_workers) as pool:
+        fits = list(pool.map(fit_candidate, *zip(*tasks)))
+
+    best = {}
+    for name, theta, rmse in fits:
+        if theta is None:
+            continue
+        if name not in best or rmse < best[name][1]:
+            best[name] = (theta, rmse, datasets[name].Ecrit)
+    return best
+
+
+"""
+MODIFY FROM HERE
+"""
+dataset_names = ('PO2016', 'SANCRIS', 'POU')
+number_of_starts = 16
+number_of_workers = None
+decimation = 1
+"""
+MODIFY BEFORE HERE
+"""
+
+if __name__ == "__main__":
+    t0 = time.time()
+    results = identify(dataset_names, number_of_starts=number_of_starts, number_of_workers=number_of_workers,
+                       decimation=decimation)
+    print("Identification finished in %.1f s\n" % (time.time() - t0))
+
+    for name in dataset_names:
+        if name not in results:
+            print("########### " + name + ": every fit failed ###########\n")
+
+    for name, (theta, rmse, Ecrit) in results.items():
+        print("########### " + name + " ###########")
+        for parameter, value in zip(parameter_names, theta):
+            print("%-6s = %.6g" % (parameter, value))
+        print("Ecrit  = %.6g J" % Ecrit)
+        print("RMSE   = %.4f V\n" % rmse)
@@ -1,61 +1,14 @@
 from res.SerialCom import SerialConfig, LoadConfig, ElectronicLoad
+from res.measurements import MeasurementWriter, read_measurements
+from res.profiles import ProfileStage, CurrentProfile, ProfileExecutor
+from res.estimation import ESTIMATE_COLUMNS, pola_soc_estimator
+from models.polaModel import PolaModel
+from res import plotting
 import sys
-import time
-import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 
 
-def experiment_current_profile(electronic_load: ElectronicLoad, current_profile, file_path, ts, t_offset=0.0):
-    # initial time
-    t0 = time.time() - t_offset
-    t = t0
-
-    # Iterate through each point
-    for t1, c in current_profile:
-        # Set current
-        electronic_load.set_current(c)
-
-        # Do stuff until reach next point
-        while time.time() - t0 < t1 + t_offset:
-            # Wait until ts seconds have been accomplished since last measurement
-            while time.time() - t <= ts:
-                pass
-
-            # Time the measurement is made
-            t = time.time()
-
-            # Measure voltage
-            volt = float(electronic_load.read_voltage_raw())
-
-            # Read current from each channel
-            electronic_load.set_channel(1)
-            curr_1 = float(electronic_load.read_current_raw())
-
-            electronic_load.set_channel(2)
-            curr_2 = float(electronic_load.read_current_raw())
-
-            electronic_load.set_channel(3)
-            curr_3 = float(electronic_load.read_current_raw())
-
-            # Put into data frame and save
-            with open(file_path, 'a') as file_handle:
-                data_dict = {'t': [t - t0],
-                             'V': [volt],
-                             'I1': [curr_1],
-                             'I2': [curr_2],
-                             'I3': [curr_3]}
-                df = pd.DataFrame(data_dict)
-                print(df)
-                df.to_csv(file_handle, index=None, header=False)
-                file_handle.close()
-
-            # Check if continue
-            if volt <= electronic_load.load.discharge_voltage:
-                return False, t0 + time.time(), data_dict
-
-    return True, t - t0, data_dict
-
-
 """
 MODIFY FROM HERE
 """
@@ -73,6 +26,18 @@ discharge_voltage = 42.5
 loop = False
 repetitions = 5
 
+# Profile. The points run forever with loop, repetitions times otherwise
+profile = CurrentProfile([ProfileStage(points, repetitions=None if loop else max(repetitions, 1))],
+                         cutoff_voltage=discharge_voltage)
+
+# Online SOC estimation with the Pola model, recorded next to the measurements
+estimate_soc = True
+model = PolaModel(dt=ts)
+x0 = [0.26, 0.85]
+p0 = np.array([[2e-4**2.0, .0], [.0, 1e-3**2.0]])
+Q = np.array([[5e-8, 0.0], [0.0, 1e-6]])
+R = np.array([[.9]])
+
 # Name of the experiment
 name = "discharge_with_current_profile_02-12-19"
 
@@ -88,82 +53,70 @@ if __name__ == "__main__":
     # Instantiate Electronic load and set
     N3300A = ElectronicLoad(conf, load, measurement_file_name=name)
 
-    # Create file where measured values will be stored. The file contains a header only.
-    file_header = ('t', 'V', 'I1', 'I2', 'I3')
-    pd.DataFrame(columns=file_header).to_csv(N3300A.measurement_file_path, index=False)
-
     # Turn off to ensure clean starting
     N3300A.turn_all_input_off()
     input("Press enter to start...")
 
-    # Do experiment
-    cum_current = 0.0
-    t_off = 0.0
-
+    # Do experiment. Samples and SOC estimates are stored as they are taken
     print("########### STARTING EXPERIMENT ###########")
-
-    if loop:
-        continue_experiment = True
-        while continue_experiment:
-            continue_experiment, t_off, data_dict = experiment_current_profile(N3300A, points,
-                                                                               N3300A.measurement_file_path,
-                                                                               ts, t_offset=t_off)
-            cum_current += data_dict["I1"][0] + data_dict["I2"][0] + data_dict["I3"][0]
-
-    elif repetitions > 0:
-        continue_experiment = True
-        loopNumber = 0
-
-        while continue_experiment and loopNumber < repetitions:
-            continue_experiment, t_off, data_dict = experiment_current_profile(N3300A, points,
-                                                                               N3300A.measurement_file_path,
-                                                                               ts, t_offset=t_off)
-            cum_current += data_dict["I1"][0] + data_dict["I2"][0] + data_dict["I3"][0]
-            loopNumber += 1
-    else:
-        experiment_current_profile(N3300A, points, N3300A.measurement_file_path, ts)
-
-    print("########### END OF EXPERIMENT ###########")
-
-    # Turn all inputs off
-    N3300A.turn_all_input_off()
+    soc_file_path = N3300A.measurement_folder_path + N3300A.measurement_file_name + "_soc.bin"
+    with MeasurementWriter(N3300A.measurement_file_path, columns=('t', 'V', 'I1', 'I2', 'I3')) as writer, \
+            MeasurementWriter(soc_file_path, columns=ESTIMATE_COLUMNS) as soc_writer:
+        estimator = pola_soc_estimator(model, x0, p0, Q, R, writer=soc_writer) if estimate_soc else None
+        executor = ProfileExecutor(N3300A, profile, sample_time=ts, writer=writer, estimator=estimator)
+        reason = executor.run()
+
+    print("########### END OF EXPERIMENT: %s ###########" % reason)
+    print("Discharged %.3f Ah, %.1f Wh" % (executor.integrator.totalChargeAh, executor.integrator.totalEnergy / 3600))
+    print(executor.engine.sampler.statistics())
+    if estimate_soc:
+        print("SOC estimate %.3f," % estimator.x[1, 0], estimator.statistics())
 
     # Plot results
-    with open(N3300A.measurement_file_path, 'r') as csv_file:
-        df = pd.read_csv(csv_file)
-
-        t = df.t.values
-        v = df.V.values
-        i1 = df.I1.values
-        i2 = df.I2.values
-        i3 = df.I3.values
-
-        # current
-        plt.subplot(131)
-        plt.plot(t, i1)
-        plt.xlabel('Time [s]')
-        plt.ylabel('Current [A]')
-        plt.title('Current channel 1')
-
-        plt.subplot(132)
-        plt.plot(t, i2)
-        plt.xlabel('Time [s]')
-        plt.ylabel('Current [A]')
-        plt.title('Current channel 2')
-
-        plt.subplot(133)
-        plt.plot(t, i3)
-        plt.xlabel('Time [s]')
-        plt.ylabel('Current [A]')
-        plt.title('Current channel 3')
-
-        plt.show()
-
-        # voltage
-        plt.plot(t, v)
+    measurements = read_measurements(N3300A.measurement_file_path)
+
+    t = measurements['t']
+    v = measurements['V']
+    i1 = measurements['I1']
+    i2 = measurements['I2']
+    i3 = measurements['I3']
+
+    # current
+    plt.subplot(131)
+    plotting.plot(t, i1)
+    plt.xlabel('Time [s]')
+    plt.ylabel('Current [A]')
+    plt.title('Current channel 1')
+
+    plt.subplot(132)
+    plotting.plot(t, i2)
+    plt.xlabel('Time [s]')
+    plt.ylabel('Current [A]')
+    plt.title('Current channel 2')
+
+    plt.subplot(133)
+    plotting.plot(t, i3)
+    plt.xlabel('Time [s]')
+    plt.ylabel('Current [A]')
+    plt.title('Current channel 3')
+
+    plt.show()
+
+    # voltage
+    plotting.plot(t, v)
+    plt.xlabel('Time [s]')
+    plt.ylabel('Current [A]')
+    plt.title('Battery pack voltage')
+
+    plt.show()
+
+    # SOC estimate
+    if estimate_soc:
+        estimates = read_measurements(soc_file_path)
+        plotting.plot(estimates['t'], estimates['SOC'])
         plt.xlabel('Time [s]')
-        plt.ylabel('Current [A]')
-        plt.title('Battery pack voltage')
+        plt.ylabel('SOC')
+        plt.title('Online SOC estimate')
 
         plt.show()
 